@@ -1,58 +1,80 @@
 import json
+import signal
+import threading
 import traceback
-from threading import Thread
 
 from base.parser import DataParser
+from core.prompt import PromptGeneratorWithAgent
+from core.speculation import SpeculativeRetriever
 from tools.ali_asr_api import AliRealTimeASR
 from tools.log import logger
 from tools.redis_client import RedisClientProxy
+from tools.worker import QueueWorker, WorkerRuntime
 
+# seconds between two scans of the registered users
+USER_SCAN_INTERVAL = 1
 
-class AudioWorker:
+
+class AudioWorker(QueueWorker):
     def __init__(self, user_id):
         self.user_id = user_id
-        self.asr = AliRealTimeASR(uid=user_id)
+        # retrieval starts on partial transcripts, before the sentence ends
+        self.speculator = SpeculativeRetriever(user_id, PromptGeneratorWithAgent())
+        self.asr = self.create_asr()
+
+    def create_asr(self):
+        return AliRealTimeASR(
+            uid=self.user_id, on_partial_result=self.speculator.submit
+        )
 
-    def pull_audio(self):
-        data = RedisClientProxy.pop_audio_data(self.user_id)
+    def pull_audio(self, timeout=None):
+        data = RedisClientProxy.pop_audio_data(self.user_id, timeout=timeout)
         if data is None:
             return None
         return json.loads(data)
 
-    def process(self):
-        while True:
-            try:
-                data = self.pull_audio()
-                if data is None:
-                    continue
+    def pull(self, timeout: int):
+        return self.pull_audio(timeout=timeout)
+
+    def handle(self, data: dict):
+        audio_data = DataParser.parse_voice_bytes(data)
+        if audio_data is None:
+            return
+
+        try:
+            self.asr.push_audio(audio_data, self.user_id)
+        except Exception:
+            self.asr = self.create_asr()
+            raise
+
+
+if __name__ == "__main__":
+    user_map = dict()
+    stop_event = threading.Event()
+
+    def shutdown(*args):
+        stop_event.set()
+        for runtime in user_map.values():
+            runtime.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
 
-                audio_data = DataParser.parse_voice_bytes(data)
-                if audio_data is None:
+    while not stop_event.is_set():
+        try:
+            users = RedisClientProxy.get_users()
+            for user in users:
+                if user in user_map:
                     continue
+                # one thread per user keeps the audio chunks in order
+                user_map[user] = WorkerRuntime(
+                    lambda user=user: AudioWorker(user_id=user),
+                    name=f"AudioWorker-{user}",
+                ).start()
+                logger.info("new user: {}".format(user))
+        except Exception as e:
+            logger.error("AudioWorker error: {}, {}".format(e, traceback.format_exc()))
+        stop_event.wait(USER_SCAN_INTERVAL)
 
-                self.asr.push_audio(audio_data, self.user_id)
-
-            except Exception as e:
-                self.asr = AliRealTimeASR(uid=self.user_id)
-                logger.error(
-                    "AudioWorker error for {}: {}, {}".format(
-                        self.user_id, e, traceback.format_exc()
-                    )
-                )
-
-
-user_map = dict()
-while True:
-    try:
-        users = RedisClientProxy.get_users()
-        if len(users) == 0:
-            continue
-        for user in users:
-            if user in user_map:
-                continue
-            audio_worker = AudioWorker(user_id=user)
-            user_map[user] = audio_worker
-            logger.info("new user: {}".format(user))
-            Thread(target=audio_worker.process).start()
-    except Exception as e:
-        logger.error("AudioWorker error: {}, {}".format(e, traceback.format_exc()))
+    for runtime in user_map.values():
+        runtime.join()
@@ -5,6 +5,7 @@ import pymongo
 
 from base.tag import Tag
 from tools.mongo import MongoClientProxy
+from tools.prompt_snapshot import PromptSnapshotStoreProxy
 from tools.time_fmt import get_timestamp
 
 
@@ -13,7 +14,10 @@ class Policy(Tag):
     policy_action: Optional[str]
 
     def save_policy(self):
-        return MongoClientProxy.get_client()["memx"]["policy"].insert_one(self.dict())
+        data = self.dict()
+        res = MongoClientProxy.get_client()["memx"]["policy"].insert_one(data)
+        PromptSnapshotStoreProxy.append(self.user_id, "policy", data)
+        return res
 
     @staticmethod
     def find_policies(*args: Any, **kwargs: Any):
@@ -53,7 +57,10 @@ class Query(Tag):
     query_report: Optional[str]
 
     def save_query(self):
-        return MongoClientProxy.get_client()["memx"]["query"].insert_one(self.dict())
+        data = self.dict()
+        res = MongoClientProxy.get_client()["memx"]["query"].insert_one(data)
+        PromptSnapshotStoreProxy.append(self.user_id, "query", data)
+        return res
 
     @staticmethod
     def find_queries(*args: Any, **kwargs: Any):
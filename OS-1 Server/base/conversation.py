@@ -11,6 +11,7 @@ from langchain.prompts.chat import (
 from base.tag import Tag
 from tools.authorization import UserController, User
 from tools.mongo import MongoClientProxy
+from tools.prompt_snapshot import PromptSnapshotStoreProxy
 from tools.time_fmt import get_timestamp
 
 
@@ -53,9 +54,15 @@ class Conversation(Tag):
         return item
 
     def save_conversation(self):
-        return MongoClientProxy.get_client()["memx"]["conversation"].insert_one(
-            self.encrypted_dict()
+        data = self.encrypted_dict()
+        res = MongoClientProxy.get_client()["memx"]["conversation"].insert_one(data)
+        # the snapshot keeps the encrypted form, like Mongo
+        PromptSnapshotStoreProxy.append(
+            self.user_id,
+            "conversation",
+            {k: v for k, v in data.items() if k not in ("_id", "audio", "prompt")},
         )
+        return res
 
     @staticmethod
     def find_conversations(*args: Any, **kwargs: Any):
@@ -6,6 +6,7 @@ import pymongo
 
 from base.tag import Tag, BaseModel
 from tools.mongo import MongoClientProxy
+from tools.prompt_snapshot import PromptSnapshotStoreProxy
 from tools.time_fmt import get_timestamp
 
 
@@ -33,7 +34,10 @@ class History(Tag):
     ai_profile: Optional[AIProfile] = AIProfile()
 
     def save_history(self):
-        return MongoClientProxy.get_client()["memx"]["history"].insert_one(self.dict())
+        data = self.dict()
+        res = MongoClientProxy.get_client()["memx"]["history"].insert_one(data)
+        PromptSnapshotStoreProxy.append(self.user_id, "history", data)
+        return res
 
     @staticmethod
     def find_histories(*args: Any, **kwargs: Any):
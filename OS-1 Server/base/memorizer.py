@@ -19,6 +19,7 @@ from tools.memory_retriever import (
 )
 from tools.mongo import MongoClientProxy
 from tools.openai_api import EmbeddingModel
+from tools.prompt_snapshot import PromptSnapshotStoreProxy, memory_section
 from tools.time_fmt import (
     PeriodOfDay,
     get_relative_time,
@@ -82,6 +83,24 @@ def get_duration(memory_type: MemoryType):
         raise Exception(f"MemoryType {memory_type} not implemented")
 
 
+# summary levels, coarsest first
+SUMMARY_TYPES = [
+    MemoryType.ONE_DAY,
+    MemoryType.THREE_HOURS,
+    MemoryType.ONE_HOUR,
+    MemoryType.TEN_MINUTES,
+]
+
+
+def get_summary_types(duration: int) -> List[MemoryType]:
+    """Summary levels for a span of `duration` ms, from the one that covers it
+    in a handful of memories down to the finest."""
+    for i, memory_type in enumerate(SUMMARY_TYPES):
+        if duration >= 2 * get_duration(memory_type):
+            return SUMMARY_TYPES[i:]
+    return SUMMARY_TYPES[-1:]
+
+
 class Memory(Tag):
     memory_id: Optional[str] = None
     memory_type: Optional[int] = None
@@ -123,12 +142,31 @@ class Memory(Tag):
     def save_memory(self):
         if self.memory_id is None:
             self.memory_id = f"{self.user_id}_{self.current_time}_{uuid4()}"
-        return MongoClientProxy.get_client()["memx"]["memory"].insert_one(self.dict())
+        data = self.dict()
+        res = MongoClientProxy.get_client()["memx"]["memory"].insert_one(data)
+        if self.memory_type is not None:
+            data.pop("_id")
+            PromptSnapshotStoreProxy.append(
+                self.user_id, memory_section(self.memory_type), data
+            )
+        return res
 
     @staticmethod
     def find_memory(*args: Any, **kwargs: Any):
         return MongoClientProxy.get_client()["memx"]["memory"].find(*args, **kwargs)
 
+    @staticmethod
+    def init_collection():
+        # range lookups of `get_memory_by_duration`
+        MongoClientProxy.get_client()["memx"]["memory"].create_index(
+            [
+                ("user_id", pymongo.ASCENDING),
+                ("memory_type", pymongo.ASCENDING),
+                ("start_time", pymongo.ASCENDING),
+                ("end_time", pymongo.ASCENDING),
+            ]
+        )
+
     @classmethod
     def get_memory_list_by_day(
         cls,
@@ -4,7 +4,9 @@ from PIL import Image
 from pydub import AudioSegment
 
 from tools.bs64 import bs642bytes
+from tools.fixation import current_fixation
 from tools.helper import VoiceHelper
+from tools.redis_client import RedisClientProxy
 
 
 class DataParser:
@@ -23,19 +25,37 @@ class DataParser:
             return None
         return gazes[-1]["norm_pos_x"], gazes[-1]["norm_pos_y"]
 
+    @staticmethod
+    def parse_fixation(data: dict):
+        """Fixation at the latest gaze of the frame, over the recent gazes of the user."""
+        if len(data["gazes"]) == 0:
+            return None
+        gazes = RedisClientProxy.get_gazes(data["user_id"]) + data["gazes"]
+        now = max(gaze["timestamp"] for gaze in data["gazes"])
+        return current_fixation(gazes, now)
+
+    @staticmethod
+    def parse_scene_bytes(data: dict):
+        """Raw bytes from the media key, or from legacy base64 payloads."""
+        if data.get("scene_key"):
+            return RedisClientProxy.get_media(data["scene_key"], queue="input_image")
+        if data.get("scene_bytes", "") == "":
+            return None
+        return bs642bytes(data["scene_bytes"])
+
     @staticmethod
     def parse_image(data: dict):
-        if data["scene_bytes"] == "":
+        scene_bytes = DataParser.parse_scene_bytes(data)
+        if scene_bytes is None:
             return None
-        scene_bytes = bs642bytes(data["scene_bytes"])
         scene_image = Image.open(io.BytesIO(scene_bytes)).rotate(angle=270, expand=True)
         return scene_image
 
     @staticmethod
     def parse_voice(data: dict):
-        if data["voice_bytes"] == "":
+        voice_bytes = DataParser.parse_voice_bytes(data)
+        if voice_bytes is None:
             return None
-        voice_bytes = bs642bytes(data["voice_bytes"])
         pcm_data = AudioSegment.from_file(
             io.BytesIO(voice_bytes),
             sample_width=2,
@@ -48,7 +68,9 @@ class DataParser:
 
     @staticmethod
     def parse_voice_bytes(data: dict):
-        if data["voice_bytes"] == "":
+        if data.get("voice_key"):
+            return RedisClientProxy.get_media(data["voice_key"], queue="input_audio")
+        if data.get("voice_bytes", "") == "":
             return None
         return bs642bytes(data["voice_bytes"])
 
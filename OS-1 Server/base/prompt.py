@@ -1,5 +1,6 @@
 import datetime
 import json
+import os
 import re
 import traceback
 from abc import ABCMeta, abstractmethod
@@ -11,16 +12,22 @@ from langchain.prompts.chat import HumanMessagePromptTemplate
 
 from base.conversation import Conversation
 from base.history import History, HumanProfile, AIProfile
-from base.memorizer import MemoryType, Memory
+from base.memorizer import MemoryType, Memory, get_summary_types
 from base.tag import Tag
 from base.visual import VisualContext
 from templates.memory import MEMORY_QUERY_PROMPT, MEMORY_QUERY_PROMPT_LLAMA
+from tools.cue_extractor import extract_cues
 from tools.llama_api import LlamaAPI
 from tools.llm import ChatModel
 from tools.log import logger
 from tools.openai_api import get_openai_chatgpt
+from tools.time_expression import TimeSpan
 from tools.time_fmt import get_timestamp, get_past_timestamp
 
+# `local` (default): memory cues by keyphrase extraction on the CPU;
+# `llama`: asked from the Vicuna server, slower
+MEMORY_CUE_MODE = os.getenv("MEMORY_CUE_MODE", "local")
+
 
 class Context(Tag):
     user_text: Optional[str] = None
@@ -56,15 +63,17 @@ class Context(Tag):
         )
 
     def get_visual_context_by_duration(
-        self, start: int, end: int, limit: int = 1, absolute_time=False
+        self, start: int, end: int, limit: int = 1, absolute_time=False, snapshot=None
     ):
-        res = VisualContext.get_contexts_by_duration(
+        res = (snapshot or VisualContext).get_contexts_by_duration(
             self.user_id, start=start, end=end, limit=limit
         )
         self.update_current_context(res, absolute_time=absolute_time)
 
-    def get_latest_visual_context(self, seconds=1800, limit=1, absolute_time=False):
-        res = VisualContext.get_latest_context(
+    def get_latest_visual_context(
+        self, seconds=1800, limit=1, absolute_time=False, snapshot=None
+    ):
+        res = (snapshot or VisualContext).get_latest_context(
             self.user_id, seconds=seconds, limit=limit, end=self.current_time
         )
         self.update_current_context(res, absolute_time=absolute_time)
@@ -75,20 +84,22 @@ class Context(Tag):
             chat_msgs.append(HumanMessagePromptTemplate.from_template(self.user_text))
         self.current_conversation = chat_msgs
 
-    def get_conversation_by_duration(self, start: int, end: int, limit: int = 3):
-        res = Conversation.get_conversation_by_duration(
+    def get_conversation_by_duration(
+        self, start: int, end: int, limit: int = 3, snapshot=None
+    ):
+        res = (snapshot or Conversation).get_conversation_by_duration(
             self.user_id, start=start, end=end, limit=limit
         )
         self.update_current_conversation(res)
 
-    def get_latest_conversation(self, seconds=1800, limit=3):
-        res = Conversation.get_latest_conversation(
+    def get_latest_conversation(self, seconds=1800, limit=3, snapshot=None):
+        res = (snapshot or Conversation).get_latest_conversation(
             self.user_id, seconds=seconds, limit=limit, end=self.current_time
         )
         self.update_current_conversation(res)
 
-    def get_latest_history(self, seconds=604800, limit=1):
-        res = History.get_latest_history(
+    def get_latest_history(self, seconds=604800, limit=1, snapshot=None):
+        res = (snapshot or History).get_latest_history(
             self.user_id, seconds=seconds, limit=limit, end=self.current_time
         )
         for item in res:
@@ -217,14 +228,47 @@ class Context(Tag):
         )
         return queries
 
+    def _generate_queries_locally(self):
+        if self.current_conversation is None or len(self.current_conversation) == 0:
+            logger.warning("No conversation, stop generating queries.")
+            return []
+        conversation_str = Conversation.msgs_to_string(
+            self.current_conversation[-3:], ai_prefix="I"
+        ).strip()
+        queries = extract_cues(conversation_str, self.current_context)
+        logger.info(f"local cues for {self.user_id}: {queries}")
+        return queries
+
     def get_unified_memory(self, k=3, score_threshold=0.8):
-        queries = self._generate_queries_with_llama()
+        if MEMORY_CUE_MODE == "llama":
+            queries = self._generate_queries_with_llama()
+        else:
+            queries = self._generate_queries_locally()
 
         res = Memory().query_memory_from_vectordb_by_indexes(
             self.user_id, queries, mem_k=k, score_threshold=score_threshold
         )
         self.unified_memory = Memory.format_memory_docs(res, now=self.current_time)
 
+    def get_temporal_memory(self, span: TimeSpan, limit=10) -> bool:
+        """Memories of a time span the user asks about, e.g. "this morning",
+        from the summaries in Mongo. `False` if there are none."""
+        for memory_type in get_summary_types(span.duration):
+            res = Memory.get_memory_by_duration(
+                self.user_id, memory_type, start=span.start, end=span.end, limit=limit
+            )
+            if len(res) > 0:
+                break
+        logger.info(
+            f"temporal memory for {self.user_id}: '{span.expression}' {memory_type.name}, {len(res)} memories"
+        )
+        if len(res) == 0:
+            return False
+        self.unified_memory = Memory.format_list(
+            res, absolute_time=False, now=self.current_time
+        )
+        return True
+
     def get_persona_memory(self, k=3, score_threshold=0.8):
         """Directly query persona memory with `user_text`."""
         if self.user_text is None or self.user_text == "(No response)":
@@ -235,8 +279,8 @@ class Context(Tag):
         )
         self.persona_memory = "\n".join([doc.page_content for doc in docs])
 
-    def get_context_summary(self):
-        res = Memory.get_memory_by_duration(
+    def get_context_summary(self, snapshot=None):
+        res = (snapshot or Memory).get_memory_by_duration(
             self.user_id,
             memory_type=MemoryType.ONE_HOUR,
             start=get_past_timestamp(current_time=self.current_time),
@@ -251,8 +295,8 @@ class Context(Tag):
         else:
             return res[-1]["end_time"]
 
-    def get_conversation_summary(self):
-        res = Memory.get_memory_by_duration(
+    def get_conversation_summary(self, snapshot=None):
+        res = (snapshot or Memory).get_memory_by_duration(
             self.user_id,
             memory_type=MemoryType.CONVERSATION,
             start=get_past_timestamp(current_time=self.current_time),
@@ -268,20 +312,34 @@ class Context(Tag):
             return res[-1]["end_time"]
 
     def get_current_context(
-        self, start: int = None, seconds=1800, limit=1, absolute_time=False
+        self, start: int = None, seconds=1800, limit=1, absolute_time=False, snapshot=None
     ):
+        """`snapshot` is a `PromptSnapshot` read instead of Mongo, if given."""
         if start is None:
             return self.get_latest_visual_context(
-                seconds=seconds, limit=limit, absolute_time=absolute_time
+                seconds=seconds,
+                limit=limit,
+                absolute_time=absolute_time,
+                snapshot=snapshot,
             )
         return self.get_visual_context_by_duration(
-            start, self.current_time, limit=limit, absolute_time=absolute_time
+            start,
+            self.current_time,
+            limit=limit,
+            absolute_time=absolute_time,
+            snapshot=snapshot,
         )
 
-    def get_current_conversation(self, start: int = None, seconds=1800, limit=3):
+    def get_current_conversation(
+        self, start: int = None, seconds=1800, limit=3, snapshot=None
+    ):
         if start is None:
-            return self.get_latest_conversation(seconds=seconds, limit=limit)
-        return self.get_conversation_by_duration(start, get_timestamp(), limit=limit)
+            return self.get_latest_conversation(
+                seconds=seconds, limit=limit, snapshot=snapshot
+            )
+        return self.get_conversation_by_duration(
+            start, get_timestamp(), limit=limit, snapshot=snapshot
+        )
 
 
 class PromptGenerator(metaclass=ABCMeta):
@@ -0,0 +1,214 @@
+from typing import Callable, List, Optional
+
+import pymongo
+
+from base.agent import Policy, Query
+from base.conversation import Conversation
+from base.history import History
+from base.memorizer import Memory, MemoryType
+from base.visual import VisualContext
+from tools.authorization import UserController
+from tools.mongo import MongoClientProxy
+from tools.prompt_snapshot import (
+    SNAPSHOT_SIZES,
+    MEMORY_SNAPSHOT_SIZE,
+    PromptSnapshotStoreProxy,
+    memory_section,
+)
+from tools.time_fmt import get_timestamp
+
+CONTEXT_PROJECTION = {
+    "original_image": 0,
+    "attended_image": 0,
+    "visual_image": 0,
+    "gaze_point": 0,
+}
+
+
+def select_latest(docs: list, time_key: str, match: Callable, limit: int) -> list:
+    """Same result as `find(match).sort(time_key, DESCENDING).limit(limit)`, reversed."""
+    res = sorted(
+        [doc for doc in docs if match(doc)], key=lambda doc: doc[time_key], reverse=True
+    )
+    if limit > 0:
+        res = res[:limit]
+    res.reverse()
+    return res
+
+
+class PromptSnapshot:
+    """Inputs of `generate_prompt` for one user, loaded in one Redis round trip.
+
+    The query methods mirror those of `Memory`, `Conversation`,
+    `VisualContext`, `History`, `Policy` and `Query`, so a snapshot can be
+    used in place of them. A section that is not materialized yet is loaded
+    from Mongo once and seeded for the next turns.
+    """
+
+    def __init__(self, user_id: str, memory_types=(MemoryType.ONE_HOUR, MemoryType.CONVERSATION)):
+        self.user_id = user_id
+        sections = list(SNAPSHOT_SIZES) + [memory_section(t.value) for t in memory_types]
+        self.sections = PromptSnapshotStoreProxy.load(user_id, sections)
+
+    def section(self, name: str, fetch: Callable[[], list]) -> list:
+        if self.sections.get(name) is None:
+            PromptSnapshotStoreProxy.begin_seed(self.user_id, name)
+            docs = fetch()
+            PromptSnapshotStoreProxy.seed(self.user_id, name, docs)
+            self.sections[name] = docs
+        return self.sections[name]
+
+    def latest_documents(self, collection: str, time_key: str, projection=None):
+        return list(
+            MongoClientProxy.get_client()["memx"][collection]
+            .find({"user_id": self.user_id}, projection)
+            .sort(time_key, pymongo.DESCENDING)
+            .limit(SNAPSHOT_SIZES[collection])
+        )
+
+    def get_memory_by_duration(
+        self,
+        user_id: str,
+        memory_type: MemoryType,
+        start: int,
+        end: int,
+        limit: int = 10,
+        filer: dict = {},
+    ):
+        if user_id != self.user_id or len(filer) > 0 or not 0 < limit <= MEMORY_SNAPSHOT_SIZE:
+            return Memory.get_memory_by_duration(
+                user_id, memory_type, start, end, limit=limit, filer=filer
+            )
+        docs = self.section(
+            memory_section(memory_type.value),
+            lambda: list(
+                Memory.find_memory(
+                    {"user_id": self.user_id, "memory_type": memory_type.value},
+                    {"_id": 0},
+                )
+                .sort("end_time", pymongo.DESCENDING)
+                .limit(MEMORY_SNAPSHOT_SIZE)
+            ),
+        )
+        return select_latest(
+            docs,
+            "end_time",
+            lambda doc: doc["start_time"] >= start and doc["end_time"] <= end,
+            limit,
+        )
+
+    def decrypt_conversations(self, docs: list) -> list:
+        if not any(doc.get("is_encrypted") for doc in docs):
+            return docs
+        # one user lookup for all documents instead of one per document
+        user = UserController().get_user(self.user_id)
+        if user is None:
+            return docs
+        return [
+            {
+                **doc,
+                "human": user.decrypt_msg(doc.get("human", "")),
+                "ai": user.decrypt_msg(doc.get("ai", "")),
+                "prompt": user.decrypt_msg(doc.get("prompt", "")),
+                "is_encrypted": False,
+            }
+            if doc.get("is_encrypted")
+            else doc
+            for doc in docs
+        ]
+
+    def get_conversation_by_duration(
+        self, user_id: str, start: int, end: int, limit: int = 10
+    ):
+        if user_id != self.user_id or not 0 < limit <= SNAPSHOT_SIZES["conversation"]:
+            return Conversation.get_conversation_by_duration(user_id, start, end, limit)
+        docs = self.section(
+            "conversation",
+            lambda: self.latest_documents(
+                "conversation", "current_time", {"_id": 0, "audio": 0, "prompt": 0}
+            ),
+        )
+        docs = select_latest(
+            docs,
+            "current_time",
+            lambda doc: start <= doc["current_time"] <= end,
+            limit,
+        )
+        return self.decrypt_conversations(docs)
+
+    def get_latest_conversation(
+        self,
+        user_id: str,
+        seconds: int = 1800,
+        limit: int = 3,
+        end: Optional[int] = None,
+    ):
+        if end is None:
+            end = get_timestamp()
+        return self.get_conversation_by_duration(user_id, end - 1000 * seconds, end, limit)
+
+    def get_contexts_by_duration(
+        self, user_id: str, start: int, end: int, limit: int = 10, sort=pymongo.DESCENDING
+    ):
+        if (
+            user_id != self.user_id
+            or sort != pymongo.DESCENDING
+            or not 0 < limit <= SNAPSHOT_SIZES["context"]
+        ):
+            return VisualContext.get_contexts_by_duration(
+                user_id, start, end, limit=limit, sort=sort
+            )
+        docs = self.section(
+            "context",
+            lambda: self.latest_documents("context", "current_time", CONTEXT_PROJECTION),
+        )
+        return select_latest(
+            docs,
+            "current_time",
+            lambda doc: start <= doc["current_time"] <= end,
+            limit,
+        )
+
+    def get_latest_context(self, user_id: str, seconds: int = 300, limit: int = 10, end=None):
+        if end is None:
+            end = get_timestamp()
+        return self.get_contexts_by_duration(user_id, end - 1000 * seconds, end, limit)
+
+    def get_latest_documents(
+        self, section: str, fallback: Callable, user_id: str, seconds: int, limit: int, end
+    ) -> List[dict]:
+        if user_id != self.user_id or not 0 < limit <= SNAPSHOT_SIZES[section]:
+            return fallback(user_id, seconds=seconds, limit=limit, end=end)
+        if end is None:
+            end = get_timestamp()
+        start = end - 1000 * seconds
+        docs = self.section(
+            section, lambda: self.latest_documents(section, "current_time")
+        )
+        return select_latest(
+            docs,
+            "current_time",
+            lambda doc: start <= doc["current_time"] <= end,
+            limit,
+        )
+
+    def get_latest_history(
+        self, user_id: str, seconds: int = 604800, limit: int = 1, end: Optional[int] = None
+    ):
+        return self.get_latest_documents(
+            "history", History.get_latest_history, user_id, seconds, limit, end
+        )
+
+    def get_latest_policy(
+        self, user_id: str, seconds: int = 600, limit: int = 1, end: Optional[int] = None
+    ):
+        return self.get_latest_documents(
+            "policy", Policy.get_latest_policy, user_id, seconds, limit, end
+        )
+
+    def get_latest_queries(
+        self, user_id: str, seconds: int = 600, limit: int = 1, end: Optional[int] = None
+    ):
+        return self.get_latest_documents(
+            "query", Query.get_latest_queries, user_id, seconds, limit, end
+        )
@@ -5,8 +5,10 @@ import pymongo
 from PIL.Image import Image
 
 from base.tag import Tag
+from tools.fixation import Fixation
 from tools.helper import TextHelper
 from tools.mongo import MongoClientProxy
+from tools.prompt_snapshot import PromptSnapshotStoreProxy
 from tools.time_fmt import get_relative_time, get_timestamp, timestamp_to_str
 
 
@@ -15,6 +17,8 @@ class VisualImage(Tag):
     attended_image: Image = None
     visual_image: Image = None
     gaze_point: Optional[Tuple[float, float]] = None
+    # set when the wearer is fixating, attention crops only run on fixations
+    fixation: Optional[Fixation] = None
 
 
 class VisualContext(Tag):
@@ -61,7 +65,18 @@ class VisualContext(Tag):
         return "\n".join(contexts)
 
     def save_context(self):
-        return MongoClientProxy.get_client()["memx"]["context"].insert_one(self.dict())
+        data = self.dict()
+        res = MongoClientProxy.get_client()["memx"]["context"].insert_one(data)
+        PromptSnapshotStoreProxy.append(
+            self.user_id,
+            "context",
+            {
+                k: v
+                for k, v in data.items()
+                if k not in ("original_image", "attended_image", "visual_image", "gaze_point")
+            },
+        )
+        return res
 
     @staticmethod
     def find_contexts(*args: Any, **kwargs: Any):
@@ -8,6 +8,7 @@ from core.context_memorizer import (
     MemoryGeneratorForContext,
     MemoryGeneratorForContextWithCluster,
 )
+from tools.llm_scheduler import BACKGROUND, set_default_priority
 from tools.log import logger
 from tools.mongo import MongoClientProxy
 from tools.time_fmt import get_past_timestamp, get_timestamp
@@ -51,4 +52,6 @@ def service():
 
 
 if __name__ == "__main__":
+    # summaries can wait, the live turns of the chatbot can not
+    set_default_priority(BACKGROUND)
     service()
@@ -6,6 +6,7 @@ import schedule
 
 from base.persona import BasicPersona
 from core.conversation_memorizer import MemoryGeneratorForConversationWithEvaluation
+from tools.llm_scheduler import BACKGROUND, set_default_priority
 from tools.log import logger
 from tools.mongo import MongoClientProxy
 from tools.time_fmt import get_past_timestamp, get_timestamp
@@ -60,6 +61,8 @@ def service():
 
 
 if __name__ == "__main__":
+    # summaries can wait, the live turns of the chatbot can not
+    set_default_priority(BACKGROUND)
     service()
 
 
@@ -6,7 +6,12 @@ from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
 )
 
-from templates.agent import POLICY_PLANNER_PROMPT, POLICY_DECIDER_PROMPT
+from templates.agent import (
+    AGENT_PLANNER_PROMPT,
+    POLICY_PLANNER_PROMPT,
+    POLICY_DECIDER_PROMPT,
+)
+from tools.helper import TextHelper
 from tools.llm import ChatModel
 from tools.log import logger
 from tools.openai_api import get_openai_chatgpt
@@ -80,6 +85,71 @@ class PolicyDecider:
         return res
 
 
+class AgentPlaner:
+    """Plan, search queries and decision of a turn in a single call, in place
+    of `PolicyPlaner`, `SearchPlaner` and `PolicyDecider`."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+    def generate(self, context: str, **kwargs) -> dict:
+        chat_model = ChatModel(
+            llm=get_openai_chatgpt(
+                temperature=0.0,
+                pl_tags=[
+                    "agent-planer",
+                    self.user_id,
+                    datetime.datetime.now().strftime("%Y-%m-%d"),
+                ],
+            )
+        )
+
+        user_msg = f"[Context]\n{context}"
+        info = kwargs.get("info")
+        if info:
+            user_msg += f"\n[Info]\n{info}"
+        plan = kwargs.get("plan")
+        if plan:
+            user_msg += f"\n{plan}"
+
+        chat_prompt = ChatPromptTemplate.from_messages(
+            [SystemMessagePromptTemplate.from_template(AGENT_PLANNER_PROMPT),
+             HumanMessagePromptTemplate.from_template(user_msg)]
+        )
+
+        res = chat_model.predict_with_msgs(chat_prompt)[0].text
+
+        logger.info(f"generate agent plan for {self.user_id}: {res}")
+
+        try:
+            res = TextHelper.parse_json(res)
+        except Exception as e:
+            logger.error(f"parse agent plan for {self.user_id} error: {e}")
+            res = {}
+        if not isinstance(res, dict):
+            logger.error(f"agent plan for {self.user_id} is not an object: {res}")
+            res = {}
+        queries = res.get("queries") or []
+        if isinstance(queries, str):
+            queries = queries.split("\n")
+        if not isinstance(queries, list):
+            queries = [queries]
+        # the model may answer numbers, or objects instead of strings
+        skipped = [item for item in queries if isinstance(item, (dict, list))]
+        if skipped:
+            logger.warning(f"skip agent queries of {self.user_id} that are not text: {skipped}")
+        queries = [
+            str(item).strip()
+            for item in queries
+            if item is not None and not isinstance(item, (dict, list))
+        ]
+        return {
+            "plan": res.get("plan") or plan,
+            "queries": [item for item in queries if item != ""],
+            "action": res.get("action"),
+        }
+
+
 if __name__ == "__main__":
     planer = PolicyPlaner(user_id="test")
     plan = planer.generate(
@@ -1,9 +1,13 @@
+import os
 import time
 from threading import Thread
 
 from base.agent import Policy, Query
 from base.prompt import Context, PromptGenerator, Conversation
-from core.policy import PolicyPlaner, PolicyDecider
+from base.snapshot import PromptSnapshot
+from core.retrieval_gate import plan_retrieval, record_temporal_memory
+from core.speculation import load_speculation
+from core.policy import AgentPlaner, PolicyPlaner, PolicyDecider
 from core.search import (
     SearchPlaner,
     SearchReporter,
@@ -11,97 +15,370 @@ from core.search import (
     dict_to_list,
     remove_duplicate_list,
 )
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+from tools.stage_graph import StageGraph
+
+# seconds a Mongo / Milvus fetch may take before the prompt is built without it
+PROMPT_STAGE_TIMEOUT = float(os.getenv("PROMPT_STAGE_TIMEOUT", 5))
+# `on` (default): read the prompt inputs from the Redis snapshot; `off`: Mongo
+PROMPT_SNAPSHOT = os.getenv("PROMPT_SNAPSHOT", "on")
+# seconds from the start of a turn the prompt waits for the policy and search
+# of this turn, before falling back to those of the previous turn
+AGENT_BUDGET = float(os.getenv("AGENT_BUDGET", 3))
+# `pipeline` (default): plan, search plan, search report and decision in
+# separate calls; `fused`: plan, search queries and decision in one call
+AGENT_MODE = os.getenv("AGENT_MODE", "pipeline")
+
+
+def gated(plan, source: str) -> bool:
+    """Whether `source` is fetched, everything is if the plan is missing."""
+    return plan is None or plan[source]
 
 
 class PromptGeneratorWithAgent(PromptGenerator):
-    def generate_policy(self, context: Context):
-        conv_context = Conversation.msgs_to_string(
-            context.current_conversation, human_prefix="User", ai_prefix="Assistant"
+    @staticmethod
+    def notify(context: Context, kind: str, value=None):
+        """Hand the result of this turn to the prompt waiting for it."""
+        RedisClientProxy.push_agent_result(
+            context.user_id, context.current_time, kind, value
         )
 
-        plan = None
-        polices = Policy.get_latest_policy(context.user_id)
-        if len(polices) != 0:
-            plan = Policy.parse_obj(polices[0]).policy_plan
+    @staticmethod
+    def get_memory(context: Context, plan):
+        if not gated(plan, "unified_memory"):
+            return
+        span = plan["time_span"] if plan else None
+        if span is not None:
+            found = context.get_temporal_memory(span)
+            record_temporal_memory(context, found)
+            if found:
+                return
+        context.get_unified_memory(k=3, score_threshold=0.5)
 
-        plan = PolicyPlaner(user_id=context.user_id).generate(
-            context=conv_context, plan=plan
-        )
+    def start_policy(self, context: Context, needed: bool):
+        if needed:
+            Thread(target=self.generate_policy, args=(context,)).start()
+            return
+        # the previous policy and search report hold, nothing to wait for
+        self.notify(context, "policy")
+        self.notify(context, "search")
 
-        thread = Thread(target=self.generate_search, args=(context, conv_context, plan))
-        thread.start()
+    def generate_policy(self, context: Context, mode: str = None) -> dict:
+        """Run the agents of a turn, return their LLM calls and seconds."""
+        mode = mode or AGENT_MODE
+        start = time.time()
+        stats = {"calls": 0}
+        try:
+            if mode == "fused":
+                self.generate_fused_policy(context, stats)
+            else:
+                self.generate_pipeline_policy(context, stats)
+        finally:
+            stats["calls"] += stats.pop("search_calls", 0)
+            stats["cost"] = round(time.time() - start, 2)
+            RedisClientProxy.incr_queue_statistic("agent", f"{mode}_turns")
+            RedisClientProxy.incr_queue_statistic(
+                "agent", f"{mode}_llm_calls", stats["calls"]
+            )
+            logger.info(f"agent {mode} for {context.user_id}: {stats}")
+        return stats
 
-        action = PolicyDecider(user_id=context.user_id).generate(
-            context=conv_context, plan=plan
-        )
-        Policy(
-            current_time=context.current_time,
-            user_id=context.user_id,
-            policy_plan=plan,
-            policy_action=action,
-        ).save_policy()
+    def generate_pipeline_policy(self, context: Context, stats: dict):
+        action = None
+        thread = None
+        try:
+            conv_context = Conversation.msgs_to_string(
+                context.current_conversation, human_prefix="User", ai_prefix="Assistant"
+            )
+
+            plan = self.latest_plan(context)
+            plan = PolicyPlaner(user_id=context.user_id).generate(
+                context=conv_context, plan=plan
+            )
+            stats["calls"] += 1
+
+            thread = Thread(
+                target=self.generate_search, args=(context, conv_context, plan, stats)
+            )
+            thread.start()
+
+            action = PolicyDecider(user_id=context.user_id).generate(
+                context=conv_context, plan=plan
+            )
+            stats["calls"] += 1
+            Policy(
+                current_time=context.current_time,
+                user_id=context.user_id,
+                policy_plan=plan,
+                policy_action=action,
+            ).save_policy()
+        finally:
+            # an empty result lets the prompt fall back without waiting
+            self.notify(context, "policy", action)
+            if thread is None:
+                self.notify(context, "search")
 
         thread.join()
 
-    def get_policy(self, context: Context):
+    def generate_fused_policy(self, context: Context, stats: dict):
+        """One call for plan, search queries and decision, the report is only
+        regenerated when the search finds something new."""
+        sent = []
+        try:
+            conv_context = Conversation.msgs_to_string(
+                context.current_conversation, human_prefix="User", ai_prefix="Assistant"
+            )
+
+            previous = self.latest_query(context)
+            info = dict_to_list(previous.query_detail) if previous else []
+            res = AgentPlaner(user_id=context.user_id).generate(
+                context=conv_context,
+                info="\n".join(info),
+                plan=self.latest_plan(context),
+            )
+            stats["calls"] += 1
+            if res["action"] is not None:
+                Policy(
+                    current_time=context.current_time,
+                    user_id=context.user_id,
+                    policy_plan=res["plan"],
+                    policy_action=res["action"],
+                ).save_policy()
+            self.notify(context, "policy", res["action"])
+            sent.append("policy")
+
+            report = self.report_search(
+                context, conv_context, res["queries"], previous, stats, skip_known=True
+            )
+            self.notify(context, "search", report)
+            sent.append("search")
+        finally:
+            for kind in ["policy", "search"]:
+                if kind not in sent:
+                    self.notify(context, kind)
+
+    @staticmethod
+    def latest_plan(context: Context):
         polices = Policy.get_latest_policy(context.user_id)
+        if len(polices) == 0:
+            return None
+        return Policy.parse_obj(polices[0]).policy_plan
+
+    @staticmethod
+    def latest_query(context: Context):
+        queries = Query.get_latest_queries(context.user_id)
+        if len(queries) == 0:
+            return None
+        return Query.parse_obj(queries[0])
+
+    def get_policy(self, context: Context, snapshot=None):
+        polices = (snapshot or Policy).get_latest_policy(context.user_id)
         if len(polices) == 0:
             return
         policy = Policy.parse_obj(polices[0])
         context.policy_action = policy.policy_action
 
-    def generate_search(self, context: Context, conv: str, plan: str):
-        info = []
-        queries = Query.get_latest_queries(context.user_id)
-        if len(queries) != 0:
-            info = dict_to_list(Query.parse_obj(queries[0]).query_detail)
+    def generate_search(self, context: Context, conv: str, plan: str, stats: dict):
+        report = None
+        try:
+            report = self.search(context, conv, plan, stats)
+        finally:
+            self.notify(context, "search", report)
+
+    def search(self, context: Context, conv: str, plan: str, stats: dict):
+        previous = self.latest_query(context)
+        info = dict_to_list(previous.query_detail) if previous else []
 
         planer = SearchPlaner(user_id=context.user_id)
-        plan = planer.generate(
+        queries = planer.generate(
             context=conv,
             info="\n".join(info),
             plan=plan,
         )
+        stats["search_calls"] = stats.get("search_calls", 0) + 1
+        return self.report_search(context, conv, queries, previous, stats)
+
+    def report_search(
+        self,
+        context: Context,
+        conv: str,
+        queries: list,
+        previous: Query,
+        stats: dict,
+        skip_known=False,
+    ):
+        known = dict_to_list(previous.query_detail) if previous else []
         worker = SearchWorker(user_id=context.user_id)
-        docs = worker.search(plan, score_threshold=0.3)
-        info = remove_duplicate_list(info + dict_to_list(docs))
+        docs = worker.search(queries, score_threshold=0.3)
+        found = dict_to_list(docs)
+        info = remove_duplicate_list(known + found)
 
         if len(info) <= 0:
             return
 
+        if skip_known and previous and previous.query_report and set(found) <= set(known):
+            # nothing new to report, the last report still holds
+            RedisClientProxy.incr_queue_statistic("agent", "report_skipped")
+            return previous.query_report
+
         reporter = SearchReporter(user_id=context.user_id)
         report = reporter.generate(
             context=conv,
             info="\n".join(info),
         )
+        stats["search_calls"] = stats.get("search_calls", 0) + 1
         Query(
             current_time=context.current_time,
             user_id=context.user_id,
-            query_plan=plan,
+            query_plan=queries,
             query_detail=docs,
             query_report=report,
         ).save_query()
+        return report
 
-    def get_search(self, context: Context):
-        queries = Query.get_latest_queries(context.user_id)
+    def get_search(self, context: Context, snapshot=None):
+        queries = (snapshot or Query).get_latest_queries(context.user_id)
         if len(queries) == 0:
             return
         query = Query.parse_obj(queries[0])
         context.search_report = query.query_report
 
-    def generate_prompt(self, context: Context) -> Context:
+    def wait_agent_result(self, context: Context, kind: str, deadline: float, fallback):
+        """Use the `kind` result of this turn if it is ready by `deadline`,
+        else `fallback` reads the one of the previous turn."""
+        value = RedisClientProxy.wait_agent_result(
+            context.user_id, context.current_time, kind, timeout=deadline - time.time()
+        )
+        fresh = value is not None
+        if fresh:
+            setattr(context, "policy_action" if kind == "policy" else "search_report", value)
+        else:
+            fallback()
+        RedisClientProxy.incr_queue_statistic(
+            "agent", f"{kind}_{'fresh' if fresh else 'previous'}"
+        )
+        logger.info(
+            "{} of {} for {}: {}".format(
+                kind, context.current_time, context.user_id, "fresh" if fresh else "previous"
+            )
+        )
+
+    def build_graph(self, context: Context, with_agent=True) -> StageGraph:
+        """Stages filling `context`, `with_agent=False` only retrieves."""
+        # independent fetches run concurrently, the prompt waits for the slowest
+        timeout = PROMPT_STAGE_TIMEOUT
+        graph = StageGraph(f"generate_prompt {context.user_id}")
+        # one round trip for every Mongo input, `None` falls back to Mongo
+        graph.add(
+            "snapshot",
+            lambda: PromptSnapshot(context.user_id) if PROMPT_SNAPSHOT == "on" else None,
+            timeout=timeout,
+        )
         # 获取对话总结和最近几轮对话
-        start = context.get_conversation_summary()
-        context.get_current_conversation(start=start, seconds=1800, limit=16)
-        Thread(target=self.generate_policy, args=(context,)).start()
-        # self.generate_policy(context)
-        start = context.get_context_summary()
-        context.get_current_context(start=start, seconds=1800, limit=1)
-        context.get_latest_history(seconds=604800, limit=1)
-        context.get_persona_memory(k=3, score_threshold=0.6)
-        context.get_unified_memory(k=3, score_threshold=0.5)
-        self.get_policy(context)
-        self.get_search(context)
+        graph.add(
+            "conversation_summary",
+            lambda snapshot: context.get_conversation_summary(snapshot=snapshot),
+            deps=["snapshot"],
+            timeout=timeout,
+        )
+        graph.add(
+            "current_conversation",
+            lambda snapshot, start: context.get_current_conversation(
+                start=start, seconds=1800, limit=16, snapshot=snapshot
+            ),
+            deps=["snapshot", "conversation_summary"],
+            timeout=timeout,
+        )
+        # sources worth fetching for this utterance, all of them ahead of time
+        graph.add(
+            "retrieval_plan",
+            lambda _: plan_retrieval(context, AGENT_MODE) if with_agent else None,
+            deps=["current_conversation"],
+            timeout=timeout,
+        )
+        graph.add(
+            "context_summary",
+            lambda snapshot, plan: context.get_context_summary(snapshot=snapshot)
+            if gated(plan, "context_summary")
+            else None,
+            deps=["snapshot", "retrieval_plan"],
+            timeout=timeout,
+        )
+        graph.add(
+            "current_context",
+            lambda snapshot, start: context.get_current_context(
+                start=start, seconds=1800, limit=1, snapshot=snapshot
+            ),
+            deps=["snapshot", "context_summary"],
+            timeout=timeout,
+        )
+        graph.add(
+            "latest_history",
+            lambda snapshot: context.get_latest_history(
+                seconds=604800, limit=1, snapshot=snapshot
+            ),
+            deps=["snapshot"],
+            timeout=timeout,
+        )
+        graph.add(
+            "persona_memory",
+            lambda plan: context.get_persona_memory(k=3, score_threshold=0.6)
+            if gated(plan, "persona_memory")
+            else None,
+            deps=["retrieval_plan"],
+            timeout=timeout,
+        )
+        graph.add(
+            "unified_memory",
+            lambda plan, _: self.get_memory(context, plan),
+            deps=["retrieval_plan", "current_context"],
+            timeout=timeout,
+        )
+        if not with_agent:
+            return graph
+        deadline = time.time() + AGENT_BUDGET
+        graph.add(
+            "generate_policy",
+            lambda plan: self.start_policy(context, gated(plan, "search")),
+            deps=["retrieval_plan"],
+        )
+        graph.add(
+            "policy",
+            lambda snapshot: self.wait_agent_result(
+                context,
+                "policy",
+                deadline,
+                lambda: self.get_policy(context, snapshot=snapshot),
+            ),
+            deps=["snapshot"],
+            timeout=AGENT_BUDGET + timeout,
+        )
+        graph.add(
+            "search",
+            lambda snapshot: self.wait_agent_result(
+                context,
+                "search",
+                deadline,
+                lambda: self.get_search(context, snapshot=snapshot),
+            ),
+            deps=["snapshot"],
+            timeout=AGENT_BUDGET + timeout,
+        )
+        return graph
+
+    def prepare_retrieval(self, context: Context) -> StageGraph:
+        """Run the retrieval stages alone, e.g. on a partial transcript."""
+        graph = self.build_graph(context, with_agent=False)
+        graph.run()
+        return graph
+
+    def generate_prompt(self, context: Context) -> Context:
+        graph = self.build_graph(context)
+        # stages already run on the partial transcript of this turn
+        for stage, result in load_speculation(context).items():
+            graph.preset(stage, result)
+        graph.run()
         return context
 
 
@@ -1,4 +1,5 @@
 import datetime
+import os
 import time
 
 from langchain.callbacks.manager import CallbackManager
@@ -13,9 +14,20 @@ from base.prompt import Context
 from base.response import Response
 from base.response import ResponseGenerator
 from core.prompt import PromptGeneratorWithHistory
-from templates.custom_prompt import CUSTOM_SYSTEM_PROMPT, DEFAULT_SYS_PROMPT
+from templates.custom_prompt import (
+    CUSTOM_SYSTEM_PROMPT,
+    CUSTOM_TURN_PROMPT,
+    DEFAULT_SYS_PROMPT,
+)
 from templates.response import CHAT_SYSTEM_PROMPT_LLAMA
 from tools.authorization import UserController
+from tools.hedge import (
+    PRIMARY,
+    SECONDARY,
+    HedgedStreamingCallbackHandler,
+    HedgeRace,
+    run_hedged,
+)
 from tools.helper import TextHelper
 from tools.llama_api import LlamaModel
 from tools.llm import ChatModel
@@ -23,13 +35,45 @@ from tools.log import logger
 from tools.openai_api import (
     StreamingCallbackHandlerWithRedis,
     UserInterrupt,
+    get_openai_chatgpt,
     get_openai_gpt4,
 )
+from tools.prompt_cache import PromptCacheMeterProxy
+from tools.prompt_packer import PromptPacker, Section, count_tokens
 from tools.time_fmt import get_timestamp
 
+# `gpt35` (default) or `llama`: model raced against GPT-4 when it is slow; `off`
+RESPONSE_HEDGE = os.getenv("RESPONSE_HEDGE", "gpt35")
+# seconds without a first token from GPT-4 before the hedge is fired
+RESPONSE_HEDGE_DELAY = float(os.getenv("RESPONSE_HEDGE_DELAY", 2.0))
+LLAMA_URL = os.getenv("LLAMA_URL", "http://localhost:8001")
+
+# section of the custom prompt -> (priority, token budget, items dropped first)
+# a lower priority is trimmed first when the prompt is over `PROMPT_TOKEN_BUDGET`,
+# sections of the cached prefix last so that it does not change with the others
+CUSTOM_PROMPT_SECTIONS = {
+    "human_profile": (8, 300, "tail"),
+    "conversation_summary": (7, 600, "head"),
+    "conversation": (6, None, "head"),
+    "policy": (5, 300, "tail"),
+    "context": (4, 400, "tail"),
+    "persona_memory": (3, 300, "tail"),
+    "unified_memory": (2, 600, "tail"),
+    "info": (1, 600, "tail"),
+}
+
 
 class ResponseGeneratorWithGPT4(ResponseGenerator):
     def generate_response(self, context: Context) -> Response:
+        race = HedgeRace(context.user_id) if RESPONSE_HEDGE != "off" else None
+        if race is None:
+            handler = StreamingCallbackHandlerWithRedis(
+                user_id=context.user_id, interruptable=True
+            )
+        else:
+            handler = HedgedStreamingCallbackHandler(
+                race, PRIMARY, user_id=context.user_id, interruptable=True
+            )
         chat_model = ChatModel(
             llm=get_openai_gpt4(
                 temperature=1.0,
@@ -40,13 +84,7 @@ class ResponseGeneratorWithGPT4(ResponseGenerator):
                     context.user_id,
                     datetime.datetime.now().strftime("%Y-%m-%d"),
                 ],
-                callback_manager=CallbackManager(
-                    [
-                        StreamingCallbackHandlerWithRedis(
-                            user_id=context.user_id, interruptable=True
-                        )
-                    ]
-                ),
+                callback_manager=CallbackManager([handler]),
             )
         )
 
@@ -56,54 +94,151 @@ class ResponseGeneratorWithGPT4(ResponseGenerator):
         if user:
             user_prompt = user.system_prompt
 
-        system_prompt = SystemMessagePromptTemplate.from_template(
-            CUSTOM_SYSTEM_PROMPT.format(
-                user_prompt=user_prompt,
-                human_profile="\n".join(
-                    [
-                        f"{key}: {value}"
-                        for key, value in context.human_profile.items()
-                        if value
-                    ]
-                ),
-                # ai_profile="\n".join(
-                #     [f"{key}: {value}" for key, value in context.ai_profile.items() if value]
-                # ),
-                # context_memory=context.context_memory,
-                # conversation_memory=context.conversation_memory,
-                unified_memory=context.unified_memory,
-                persona_memory=context.persona_memory,
-                # context_summary=context.context_summary,
-                conversation_summary=context.conversation_summary,
-                context=context.current_context,
-                policy=context.policy_action,
-                info=context.search_report,
-            )
-        )
-
+        system_prompt, msgs, turn_prompt = self.pack_prompt(context, user_prompt)
+        # stable prefix first, the inputs of this turn after the conversation
         chat_prompt = ChatPromptTemplate.from_messages(
-            [system_prompt] + context.current_conversation
+            [SystemMessagePromptTemplate.from_template(system_prompt)]
+            + msgs
+            + [SystemMessagePromptTemplate.from_template(turn_prompt)]
         )
+        try:
+            PromptCacheMeterProxy.record(
+                context.user_id,
+                [f"{msg.type}: {msg.content}" for msg in chat_prompt.format_messages()],
+            )
+        except Exception as e:
+            logger.error(f"prompt cache meter error for {context.user_id}: {e}")
 
+        model = "gpt4"
         try:
-            res = chat_model.predict_with_msgs(chat_prompt)
+            if race is None:
+                res = chat_model.predict_with_msgs(chat_prompt)
+            else:
+                winner, res = run_hedged(
+                    race,
+                    lambda: chat_model.predict_with_msgs(chat_prompt),
+                    lambda: self.hedge_model(context, race).predict_with_msgs(chat_prompt),
+                    RESPONSE_HEDGE_DELAY,
+                )
+                model = "gpt4" if winner == PRIMARY else RESPONSE_HEDGE
             res = res[0].text
         except UserInterrupt as e:
             res = e.response + "..." + "(INTERRUPTED BY USER)"
 
-        logger.info(f"gpt4 response for {context.user_id}: {res}")
+        logger.info(f"{model} response for {context.user_id}: {res}")
 
         res = TextHelper.remove_non_text(res)
 
         return Response(context=context, prompt=chat_prompt.format(), reply=res)
 
+    @staticmethod
+    def hedge_model(context: Context, race: HedgeRace) -> ChatModel:
+        """Model raced against GPT-4, on the same prompt."""
+        callback_manager = CallbackManager(
+            [
+                HedgedStreamingCallbackHandler(
+                    race, SECONDARY, user_id=context.user_id, interruptable=True
+                )
+            ]
+        )
+        if RESPONSE_HEDGE == "llama":
+            return ChatModel(
+                llm=LlamaModel(
+                    temperature=0.5,
+                    url=LLAMA_URL,
+                    resp_prefix="(",
+                    streaming=True,
+                    callback_manager=callback_manager,
+                )
+            )
+        return ChatModel(
+            llm=get_openai_chatgpt(
+                temperature=1.0,
+                streaming=True,
+                n=1,
+                pl_tags=[
+                    "gpt35-hedge",
+                    context.user_id,
+                    datetime.datetime.now().strftime("%Y-%m-%d"),
+                ],
+                callback_manager=callback_manager,
+            )
+        )
+
+    @staticmethod
+    def pack_prompt(context: Context, user_prompt: str):
+        """Fill the custom prompt within `PROMPT_TOKEN_BUDGET` tokens.
+
+        Returns the system prompt, the messages of the conversation kept, at
+        least the last one, and the prompt of this turn.
+        """
+        texts = {
+            "human_profile": "\n".join(
+                [f"{key}: {value}" for key, value in context.human_profile.items() if value]
+            ),
+            "policy": context.policy_action,
+            "context": context.current_context,
+            "persona_memory": context.persona_memory,
+            "unified_memory": context.unified_memory,
+            "conversation_summary": context.conversation_summary,
+            "info": context.search_report,
+        }
+        msgs = context.current_conversation or []
+        sections = []
+        for name, (priority, budget, drop) in CUSTOM_PROMPT_SECTIONS.items():
+            if name == "conversation":
+                # whole messages only, the last one is the user's turn
+                section = Section(
+                    name,
+                    None,
+                    priority=priority,
+                    budget=budget,
+                    drop=drop,
+                    keep=1,
+                    cut=False,
+                    items=[msg.format().content for msg in msgs],
+                )
+            else:
+                section = Section(
+                    name, texts[name], priority=priority, budget=budget, drop=drop
+                )
+            sections.append(section)
+
+        fixed = count_tokens(
+            CUSTOM_SYSTEM_PROMPT.format(
+                user_prompt=user_prompt, human_profile="", conversation_summary=""
+            )
+        ) + count_tokens(
+            CUSTOM_TURN_PROMPT.format(
+                persona_memory="", unified_memory="", context="", info="", policy=""
+            )
+        )
+        packed = PromptPacker().pack(
+            sections, fixed=fixed, name=f"custom prompt {context.user_id}"
+        )
+        texts = {name: packed[name].text for name in texts}
+        system_prompt = CUSTOM_SYSTEM_PROMPT.format(
+            user_prompt=user_prompt,
+            human_profile=texts["human_profile"],
+            conversation_summary=texts["conversation_summary"],
+        )
+        turn_prompt = CUSTOM_TURN_PROMPT.format(
+            persona_memory=texts["persona_memory"],
+            unified_memory=texts["unified_memory"],
+            context=texts["context"],
+            info=texts["info"],
+            policy=texts["policy"],
+        )
+        kept = len(packed["conversation"].items)
+        return system_prompt, msgs[len(msgs) - kept :], turn_prompt
+
 
 class ResponseGeneratorWithLLama(ResponseGenerator):
     def generate_response(self, context: Context) -> Response:
         chat_model = ChatModel(
             llm=LlamaModel(
                 temperature=0.5,
-                url="http://localhost:8001",
+                url=LLAMA_URL,
                 resp_prefix="(",
                 streaming=True,
                 callback_manager=CallbackManager(
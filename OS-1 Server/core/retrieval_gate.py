@@ -0,0 +1,146 @@
+import os
+import re
+from typing import List, Optional
+
+from base.prompt import MEMORY_CUE_MODE, Context
+from base.conversation import Conversation
+from tools.cue_extractor import extract_cues
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+from tools.time_expression import parse_time_expression
+
+# `on` (default): fetch only the sources an utterance is likely to need
+RETRIEVAL_GATE = os.getenv("RETRIEVAL_GATE", "on")
+
+# sources of `PromptGeneratorWithAgent.build_graph` the gate may skip
+GATED_SOURCES = ["unified_memory", "persona_memory", "search", "context_summary"]
+
+BACKCHANNELS = set(
+    """
+    ok okay k kk yes yeah yep yup sure no nope nah hmm hm mm mhm uh um oh ah aha
+    wow cool nice great fine good right alright thanks thank thx lol haha hahaha
+    bye goodbye hi hello hey really indeed exactly true got it see i
+    嗯 哦 好 好的 对 是 是的 行 嗯嗯 哈哈 谢谢 拜拜 没事 可以
+    """.split()
+)
+RECALL_PATTERN = re.compile(
+    r"\b(remember|recall|forgot|forget|last time|before|earlier|yesterday|"
+    r"last (week|month|year|night)|ago|told you|we talked|did i|have i|"
+    r"was i|my (mom|dad|friend|wife|husband|boss|name))\b"
+    r"|记得|上次|之前|以前|昨天|上周|忘了|说过",
+    re.IGNORECASE,
+)
+QUESTION_PATTERN = re.compile(
+    r"[?？]\s*$|^(what|who|whom|whose|where|when|why|how|which|do|does|did|can|"
+    r"could|would|will|should|is|are|was|were|have|has)\b"
+    r"|吗\s*$|什么|为什么|怎么|哪|谁",
+    re.IGNORECASE,
+)
+TOKEN_PATTERN = re.compile(r"[\w']+")
+# latin words and CJK characters, a rough length of the utterance
+WORD_PATTERN = re.compile(r"[A-Za-z']+|[\u4e00-\u9fff]")
+
+
+def classify_utterance(text: Optional[str]) -> str:
+    """silence | backchannel | recall | question | short | statement"""
+    if text is None or text.strip() in ("", "(No response)"):
+        return "silence"
+    words = WORD_PATTERN.findall(text)
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) <= 3 and all(token in BACKCHANNELS for token in tokens):
+        return "backchannel"
+    if RECALL_PATTERN.search(text):
+        return "recall"
+    if QUESTION_PATTERN.search(text.strip()):
+        return "question"
+    if len(words) <= 3:
+        return "short"
+    return "statement"
+
+
+def last_ai_message(msgs: Optional[List]) -> Optional[str]:
+    for msg in reversed(msgs or []):
+        msg = msg.format()
+        if msg.type == "ai":
+            return msg.content
+    return None
+
+
+def plan_retrieval(context: Context, agent_mode: str) -> dict:
+    """Sources worth fetching for the utterance of this turn.
+
+    Reads `current_conversation`, so it runs once the conversation is loaded.
+    """
+    kind = classify_utterance(context.user_text)
+    plan = {source: True for source in GATED_SOURCES}
+    if RETRIEVAL_GATE != "on":
+        return {"kind": kind, "time_span": None, **plan}
+
+    if kind in ("silence", "backchannel"):
+        plan = {source: False for source in GATED_SOURCES}
+    elif kind == "short":
+        last = last_ai_message(context.current_conversation)
+        # a short answer to a question may name something to look up
+        answers = last is not None and QUESTION_PATTERN.search(last.strip()) is not None
+        plan.update(persona_memory=False, search=False, unified_memory=answers)
+    # "what did I do this morning" is answered from the summaries of the morning
+    span = None
+    if kind in ("recall", "question") and plan["unified_memory"]:
+        span = parse_time_expression(context.user_text, context.current_time)
+    record_retrieval(context, kind, plan, agent_mode)
+    return {"kind": kind, "time_span": span, **plan}
+
+
+def skipped_calls(context: Context, plan: dict, agent_mode: str) -> dict:
+    """Milvus and LLM calls the skipped sources would have made, at most."""
+    milvus = 0
+    llm = 0
+    if not plan["unified_memory"] and context.current_conversation:
+        # one Milvus search per cue, the cues are cheap to extract
+        conversation = Conversation.msgs_to_string(
+            context.current_conversation[-3:], ai_prefix="I"
+        )
+        milvus += len(extract_cues(conversation, context.current_context))
+        llm += 1 if MEMORY_CUE_MODE == "llama" else 0
+    if not plan["persona_memory"] and classify_utterance(context.user_text) != "silence":
+        milvus += 1
+    if not plan["search"]:
+        # planner, search planner, reporter, decider; the fused mode merges three
+        llm += 2 if agent_mode == "fused" else 4
+    return {"milvus": milvus, "llm": llm}
+
+
+def record_temporal_memory(context: Context, found: bool):
+    """Count a turn served by a time range lookup, or its fall back to cues."""
+    RedisClientProxy.incr_queue_statistic(
+        "retrieval_gate", "temporal_hit" if found else "temporal_miss"
+    )
+    if found and context.current_conversation:
+        conversation = Conversation.msgs_to_string(
+            context.current_conversation[-3:], ai_prefix="I"
+        )
+        RedisClientProxy.incr_queue_statistic(
+            "retrieval_gate",
+            "milvus_calls_skipped",
+            len(extract_cues(conversation, context.current_context)),
+        )
+        if MEMORY_CUE_MODE == "llama":
+            RedisClientProxy.incr_queue_statistic("retrieval_gate", "llm_calls_skipped")
+
+
+def record_retrieval(context: Context, kind: str, plan: dict, agent_mode: str):
+    skipped = [source for source in GATED_SOURCES if not plan[source]]
+    calls = skipped_calls(context, plan, agent_mode)
+    RedisClientProxy.incr_queue_statistic("retrieval_gate", kind)
+    for source in skipped:
+        RedisClientProxy.incr_queue_statistic("retrieval_gate", f"{source}_skipped")
+    for name, count in calls.items():
+        if count > 0:
+            RedisClientProxy.incr_queue_statistic(
+                "retrieval_gate", f"{name}_calls_skipped", count
+            )
+    logger.info(
+        "retrieval plan for {}: {} '{}', skip {}, calls skipped {}".format(
+            context.user_id, kind, context.user_text, skipped, calls
+        )
+    )
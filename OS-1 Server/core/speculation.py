@@ -0,0 +1,131 @@
+import difflib
+import json
+import os
+import threading
+
+from base.prompt import Context
+from tools.helper import TextHelper
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+from tools.stage_graph import StageGraph
+from tools.time_fmt import get_timestamp
+
+# `on` (default): retrieve on partial transcripts while the user is speaking
+SPECULATION = os.getenv("SPECULATION", "on")
+# words a partial transcript needs, and has to gain, before retrieval is run
+SPECULATION_MIN_WORDS = int(os.getenv("SPECULATION_MIN_WORDS", 3))
+SPECULATION_STEP_WORDS = int(os.getenv("SPECULATION_STEP_WORDS", 2))
+# word-level similarity between the partial and the final transcript
+SPECULATION_SIMILARITY = float(os.getenv("SPECULATION_SIMILARITY", 0.8))
+# seconds a speculation waits for its final transcript
+SPECULATION_TTL = int(os.getenv("SPECULATION_TTL", 15))
+
+# stages of `PromptGeneratorWithAgent.build_graph` -> context fields they fill
+SPECULATED_STAGES = {
+    "context_summary": ["context_summary"],
+    "current_context": ["current_context", "context_id"],
+    "latest_history": ["human_profile", "ai_profile", "history_id"],
+    "persona_memory": ["persona_memory"],
+    "unified_memory": ["unified_memory"],
+}
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Word-level similarity in [0, 1], cheap enough for the critical path."""
+    return difflib.SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+def save_speculation(context: Context, graph: StageGraph):
+    results = {}
+    fields = {}
+    for stage, names in SPECULATED_STAGES.items():
+        if graph.timings.get(stage, {}).get("status") != "ok":
+            continue
+        results[stage] = graph.results[stage]
+        fields.update({name: getattr(context, name) for name in names})
+    RedisClientProxy.set_speculation(
+        context.user_id,
+        json.dumps({"text": context.user_text, "results": results, "fields": fields}),
+        timeout=SPECULATION_TTL,
+    )
+
+
+def load_speculation(context: Context) -> dict:
+    """Fill `context` from the speculation of this turn if its text is close
+    enough, and return the results of the stages it covers."""
+    if SPECULATION != "on":
+        return {}
+    data = RedisClientProxy.pop_speculation(context.user_id)
+    if data is None:
+        return {}
+    data = json.loads(data)
+    similarity = text_similarity(data["text"], context.user_text or "")
+    if similarity < SPECULATION_SIMILARITY:
+        RedisClientProxy.incr_queue_statistic("speculation", "miss")
+        logger.info(
+            "speculation miss for {}: {:.2f} '{}'".format(
+                context.user_id, similarity, data["text"]
+            )
+        )
+        return {}
+    for name, value in data["fields"].items():
+        setattr(context, name, value)
+    RedisClientProxy.incr_queue_statistic("speculation", "hit")
+    logger.info(
+        "speculation hit for {}: {:.2f}, {}".format(
+            context.user_id, similarity, list(data["results"])
+        )
+    )
+    return data["results"]
+
+
+class SpeculativeRetriever:
+    """Run the retrieval of a turn on the partial transcript of the user.
+
+    At most one run per user is in flight, a newer partial transcript
+    replaces the one waiting for it.
+    """
+
+    def __init__(self, user_id: str, prompt_generator):
+        self.user_id = user_id
+        self.prompt_generator = prompt_generator
+        self.lock = threading.Lock()
+        self.running = False
+        self.next_text = None
+        self.last_words = 0
+
+    def submit(self, text: str):
+        if SPECULATION != "on" or not TextHelper.is_english(text):
+            return
+        words = len(text.split())
+        with self.lock:
+            # fewer words than last time: a new sentence or a revised one
+            if words >= self.last_words and words - self.last_words < SPECULATION_STEP_WORDS:
+                return
+            self.last_words = words
+            if words < SPECULATION_MIN_WORDS:
+                return
+            self.next_text = text
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                text, self.next_text = self.next_text, None
+                if text is None:
+                    self.running = False
+                    return
+            try:
+                self.speculate(text)
+            except Exception as e:
+                logger.error(f"speculation for {self.user_id} error: {e}")
+
+    def speculate(self, text: str):
+        context = Context(
+            current_time=get_timestamp(), user_id=self.user_id, user_text=text
+        )
+        graph = self.prompt_generator.prepare_retrieval(context)
+        save_speculation(context, graph)
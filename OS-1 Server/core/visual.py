@@ -27,28 +27,33 @@ class VisualContextRecognizer(VisualPerceptron):
 
         pool = ThreadPoolExecutor(max_workers=3)
 
-        attention_task = pool.submit(
-            get_attended_image,
-            visual_image.original_image.copy(),
-            float(visual_image.gaze_point[0]),
-            float(visual_image.gaze_point[1]),
-        )
-
         scene_task = pool.submit(
             LlavaVisualAssistant.inference,
             visual_image.original_image.copy(),
         )
 
-        visual_image.visual_image, visual_image.attended_image = attention_task.result()
-        visual_context.attention = pool.submit(
-            LlavaVisualAssistant.inference, visual_image.attended_image.copy()
-        ).result()
+        # the wearer only attends to something while fixating, a glance or a
+        # saccade is not worth the RPN and the second LLaVA pass
+        if visual_image.fixation is not None:
+            attention_task = pool.submit(
+                get_attended_image,
+                visual_image.original_image.copy(),
+                float(visual_image.gaze_point[0]),
+                float(visual_image.gaze_point[1]),
+            )
+            visual_image.visual_image, visual_image.attended_image = attention_task.result()
+            visual_context.attention = pool.submit(
+                LlavaVisualAssistant.inference, visual_image.attended_image.copy()
+            ).result()
+        else:
+            visual_image.visual_image = visual_image.original_image
         visual_context.scene = scene_task.result()
 
         pool.shutdown()
 
         visual_context.original_image = image2bs64(visual_image.original_image)
-        visual_context.attended_image = image2bs64(visual_image.attended_image)
+        if visual_image.attended_image is not None:
+            visual_context.attended_image = image2bs64(visual_image.attended_image)
         visual_context.visual_image = image2bs64(visual_image.visual_image)
 
         logger.info(
@@ -1,22 +1,22 @@
 import json
-import traceback
-from multiprocessing import Process
 
 from base.parser import DataParser
 from base.visual import VisualImage
 from core.visual import VisualContextRecognizer
 from tools.log import logger
-from tools.redis_client import RedisClientProxy
+from tools.redis_client import IMAGE_DEADLINE, RedisClientProxy
+from tools.time_fmt import get_timestamp
+from tools.worker import QueueWorker, get_worker_config, run_workers
 
 
-class ImageWorker:
+class ImageWorker(QueueWorker):
     def __init__(self, visual_context_recognizer=VisualContextRecognizer()):
         self.visual_context_recognizer = visual_context_recognizer
         logger.info("ImageWorker init")
 
     @staticmethod
-    def pull_image():
-        data = RedisClientProxy.pop_image_data()
+    def pull_image(timeout=None):
+        data = RedisClientProxy.pop_image_data(timeout=timeout)
         if data is None:
             return None
         return json.loads(data)
@@ -27,39 +27,50 @@ class ImageWorker:
             user_id=DataParser.parse_uid(data),
             original_image=DataParser.parse_image(data),
             gaze_point=DataParser.parse_gaze(data),
+            fixation=DataParser.parse_fixation(data),
         )
         if visual_image.original_image is None or visual_image.gaze_point is None:
             return None
+        if visual_image.fixation is not None:
+            visual_image.gaze_point = (visual_image.fixation.x, visual_image.fixation.y)
+            RedisClientProxy.incr_queue_statistic("input_image", "fixated")
         return visual_image
 
-    def process(self):
-        while True:
-            try:
-                data = self.pull_image()
-                if data is None:
-                    continue
-                visual_image = self.create_visual_image(data)
-                if visual_image is None:
-                    continue
-                visual_context = self.visual_context_recognizer.recognize_context_with_conversation(
-                    visual_image
-                )
-                if visual_context.scene == "":
-                    logger.warning(
-                        "Empty scene for {}".format(visual_context.user_id)
-                    )
-                    continue
-                visual_context.save_context()
-            except Exception as e:
-                logger.error(
-                    "ImageWorker error: {}, {}".format(e, traceback.format_exc())
+    def pull(self, timeout: int):
+        return self.pull_image(timeout=timeout)
+
+    def ack(self, data: dict):
+        RedisClientProxy.ack_image_data()
+
+    def handle(self, data: dict):
+        delay = get_timestamp() - DataParser.parse_time(data)
+        if delay > IMAGE_DEADLINE:
+            RedisClientProxy.incr_queue_statistic("input_image", "expired")
+            logger.warning(
+                "Drop expired frame of {}: {:.2f}s".format(
+                    DataParser.parse_uid(data), delay / 1000
                 )
+            )
+            return
+        visual_image = self.create_visual_image(data)
+        if visual_image is None:
+            return
+        visual_context = self.visual_context_recognizer.recognize_context_with_conversation(
+            visual_image
+        )
+        if visual_context.scene == "":
+            logger.warning(
+                "Empty scene for {}".format(visual_context.user_id)
+            )
+            return
+        visual_context.save_context()
+        RedisClientProxy.incr_queue_statistic("input_image", "processed")
 
 
-num_workers = 2
-thread_list = []
-for _ in range(num_workers):
-    thread = Process(target=ImageWorker().process)
-    thread.start()
-    thread_list.append(thread)
-[thread.join() for thread in thread_list]
+if __name__ == "__main__":
+    num_processes, num_threads = get_worker_config("image", processes=2)
+    run_workers(
+        ImageWorker,
+        num_processes=num_processes,
+        num_threads=num_threads,
+    )
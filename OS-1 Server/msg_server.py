@@ -9,6 +9,7 @@ from core.message import MessageSenderWithRedis, VoiceGeneratorWithTTS
 from tools.log import logger
 from tools.redis_client import RedisClientProxy
 from tools.time_fmt import get_timestamp
+from tools.worker import POP_TIMEOUT
 
 
 class MessageWorker:
@@ -22,12 +23,18 @@ class MessageWorker:
         logger.info("MessageWorker init")
 
     @staticmethod
-    def pull_msg_text():
-        data = RedisClientProxy.pop_msg_text()
+    def pull_msg_text(timeout=None):
+        data = RedisClientProxy.pop_msg_text(timeout=timeout)
         if data is None:
             return None
         return json.loads(data)
 
+    @staticmethod
+    def pull_msg_entry(timeout=None):
+        """Pop in the calling thread and keep the entry id for the ack."""
+        data = MessageWorker.pull_msg_text(timeout=timeout)
+        return RedisClientProxy.last_entry_id("response_text"), data
+
     @staticmethod
     def create_message(data):
         return Message.parse_obj(data)
@@ -35,7 +42,7 @@ class MessageWorker:
     def process(self):
         while True:
             try:
-                data = self.pull_msg_text()
+                data = self.pull_msg_text(timeout=POP_TIMEOUT)
                 if data is None:
                     continue
                 msg = self.create_message(data)
@@ -51,12 +58,22 @@ class MessageWorker:
                     "Send Extra Statistic info: {}, {}".format(msg.user_id, extra)
                 )
                 self.message_sender.send_message(msg, extra=extra)
+                RedisClientProxy.ack_msg_text()
             except Exception as e:
                 logger.error(
                     "MessageWorker error: {}, {}".format(e, traceback.format_exc())
                 )
 
-    async def process_msg(self, msg, semaphore):
+    async def process_msg(self, msg, semaphore, entry_id=None):
+        try:
+            await self.send_msg(msg, semaphore, entry_id)
+        except Exception as e:
+            # not acknowledged, the entry is redelivered up to the delivery cap
+            logger.error(
+                "MessageWorker error: {}, {}".format(e, traceback.format_exc())
+            )
+
+    async def send_msg(self, msg, semaphore, entry_id=None):
         async with semaphore:
             loop = asyncio.get_event_loop()
 
@@ -74,15 +91,20 @@ class MessageWorker:
                     "Send Extra Statistic info: {}, {}".format(msg.user_id, extra)
                 )
             self.message_sender.send_message(msg, extra=extra)
+            RedisClientProxy.ack_msg_text(entry_id)
     
     async def aprocess(self):
         user_queues = {}
         user_semaphores = {}
 
+        loop = asyncio.get_event_loop()
+
         while True:
-            await asyncio.sleep(0.01)
             try:
-                data = self.pull_msg_text()
+                # block in the executor instead of polling the queue every 10ms
+                entry_id, data = await loop.run_in_executor(
+                    None, self.pull_msg_entry, POP_TIMEOUT
+                )
                 if data is None:
                     continue
                 msg = self.create_message(data)
@@ -97,7 +119,7 @@ class MessageWorker:
 
                 if not user_queues[userid].empty():
                     # Start asynchronous data processing for this userid
-                    asyncio.create_task(self.process_msg(await user_queues[userid].get(), user_semaphores[userid]))
+                    asyncio.create_task(self.process_msg(await user_queues[userid].get(), user_semaphores[userid], entry_id))
                 
             except Exception as e:
                 logger.error(
@@ -0,0 +1,68 @@
+"""LLM calls and wall time per turn of the agent, pipeline vs fused mode.
+
+Every mode replays the same turns for a new user of each run, so that both
+start from an empty policy and search history. The LLM cache is off, a repeated
+run would otherwise measure cache hits instead of the planners:
+
+    python scripts/agent_benchmark.py --turns 5
+
+Policies and queries are saved for `benchmark-agent-*` users, run it against
+a staging database.
+"""
+import argparse
+import json
+import os
+import uuid
+
+# read by `tools.llm_cache` on import
+os.environ["LLM_CACHE"] = "off"
+
+import numpy as np
+from langchain.prompts.chat import HumanMessagePromptTemplate
+
+from base.prompt import Context
+from core.prompt import PromptGeneratorWithAgent
+from tools.time_fmt import get_timestamp
+
+TURNS = [
+    "I have doubts about my own abilities, and I feel confused about the path ahead.",
+    "My research is not going anywhere, I have been stuck for weeks.",
+    "I used to love it, that is why I applied for the postgraduate program.",
+    "Maybe I should talk to my advisor, but I am afraid of disappointing her.",
+    "What would you do if you were me?",
+]
+
+
+def run(mode: str, num_turns: int, run_id: str):
+    generator = PromptGeneratorWithAgent()
+    msgs = []
+    calls, costs = [], []
+    for i in range(num_turns):
+        msgs.append(HumanMessagePromptTemplate.from_template(TURNS[i % len(TURNS)]))
+        context = Context(
+            current_time=get_timestamp(),
+            user_id=f"benchmark-agent-{mode}-{run_id}",
+            current_conversation=list(msgs),
+        )
+        stats = generator.generate_policy(context, mode=mode)
+        calls.append(stats["calls"])
+        costs.append(stats["cost"])
+    return {
+        "calls_per_turn": round(float(np.mean(calls)), 2),
+        "p50_s": round(float(np.percentile(costs, 50)), 2),
+        "p99_s": round(float(np.percentile(costs, 99)), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=len(TURNS))
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    print(
+        json.dumps(
+            {mode: run(mode, args.turns, run_id) for mode in ["pipeline", "fused"]},
+            indent=2,
+        )
+    )
@@ -0,0 +1,100 @@
+"""Latency of light users sharing a queue with a heavy user, fifo vs fair.
+
+One heavy user pushes `--heavy` items at once, then every light user pushes
+a single item; `--consumers` threads pop with a fixed service time:
+
+    python scripts/fair_queue_benchmark.py --heavy 500 --light 20 --consumers 4
+
+Items go to `benchmark_*` keys, run it against a staging Redis.
+"""
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from tools.fair_queue import FairQueue
+from tools.redis_client import RedisClientProxy
+
+
+def fifo_queue(redis_client, queue):
+    class FifoQueue:
+        def push(self, uid, data):
+            redis_client.rpush(queue, data)
+
+        def pop(self, timeout=None):
+            res = redis_client.blpop(queue, timeout=timeout)
+            return res[1] if res else None
+
+    return FifoQueue()
+
+
+def run(queue, num_heavy, num_light, num_consumers, service_time):
+    latencies = {"heavy": [], "light": []}
+    lock = threading.Lock()
+    remaining = [num_heavy + num_light]
+
+    def consume():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+            data = queue.pop(timeout=1)
+            if data is None:
+                continue
+            time.sleep(service_time)
+            item = json.loads(data)
+            with lock:
+                remaining[0] -= 1
+                latencies[item["kind"]].append(time.time() - item["time"])
+
+    for _ in range(num_heavy):
+        item = {"kind": "heavy", "time": time.time()}
+        queue.push("benchmark-heavy", json.dumps(item))
+    for i in range(num_light):
+        item = {"kind": "light", "time": time.time()}
+        queue.push(f"benchmark-light-{i}", json.dumps(item))
+
+    consumers = [threading.Thread(target=consume) for _ in range(num_consumers)]
+    [consumer.start() for consumer in consumers]
+    [consumer.join() for consumer in consumers]
+
+    res = {}
+    for kind, values in latencies.items():
+        values = np.array(values) * 1000
+        res[kind] = {
+            "p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p99_ms": round(float(np.percentile(values, 99)), 2),
+        }
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heavy", type=int, default=500)
+    parser.add_argument("--light", type=int, default=20)
+    parser.add_argument("--consumers", type=int, default=4)
+    parser.add_argument("--service_ms", type=float, default=10)
+    args = parser.parse_args()
+
+    redis_client = RedisClientProxy.get_client()
+    queues = {
+        "fifo": fifo_queue(redis_client, "benchmark_queue"),
+        "fair": FairQueue(redis_client, "benchmark_queue"),
+    }
+    print(
+        json.dumps(
+            {
+                mode: run(
+                    queue,
+                    args.heavy,
+                    args.light,
+                    args.consumers,
+                    args.service_ms / 1000,
+                )
+                for mode, queue in queues.items()
+            },
+            indent=2,
+        )
+    )
@@ -0,0 +1,161 @@
+"""Load test for the `/heartbeat` ingest path of `data_server.py`.
+
+Start the server once per ingest mode and run the same load against it:
+
+    HEARTBEAT_INGEST=thread python data_server.py
+    python scripts/heartbeat_benchmark.py --requests 2000 --concurrency 64
+
+    HEARTBEAT_INGEST=async python data_server.py
+    python scripts/heartbeat_benchmark.py --requests 2000 --concurrency 64
+
+Compare single heartbeats with `/heartbeat/batch`, each item being one second
+of wear time; `--server_pid` also reports the server CPU per minute of wear:
+
+    python scripts/heartbeat_benchmark.py --requests 2000 --server_pid 1234
+    python scripts/heartbeat_benchmark.py --requests 2000 --batch 10 --server_pid 1234
+
+The payloads are random bytes pushed to the real queues under `benchmark-*`
+user ids, so run it against a staging Redis without workers attached.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+def build_payload(uid, scene_bytes, voice_bytes):
+    data = {
+        "timestamp": int(time.time() * 1000),
+        "uid": uid,
+        "gazes": [
+            {
+                "timestamp": int(time.time() * 1000),
+                "confidence": 0.9,
+                "norm_pos_x": 0.5,
+                "norm_pos_y": 0.5,
+                "diameter": 10,
+            }
+        ],
+    }
+    return {
+        "data": (None, json.dumps(data)),
+        "scene_file": ("scene.jpg", scene_bytes, "image/jpeg"),
+        "voice_file": ("voice.pcm", voice_bytes, "application/octet-stream"),
+    }
+
+
+def build_batch_payload(uid, batch, scene_bytes, voice_bytes):
+    now = int(time.time() * 1000)
+    items = []
+    files = {}
+    for i in range(batch):
+        items.append(
+            {
+                "timestamp": now - (batch - i) * 1000,
+                "gazes": [
+                    {
+                        "timestamp": now - (batch - i) * 1000,
+                        "confidence": 0.9,
+                        "norm_pos_x": 0.5,
+                        "norm_pos_y": 0.5,
+                        "diameter": 10,
+                    }
+                ],
+                "scene_file": f"scene_{i}",
+                "voice_file": f"voice_{i}",
+            }
+        )
+        files[f"scene_{i}"] = ("scene.jpg", scene_bytes, "image/jpeg")
+        files[f"voice_{i}"] = ("voice.pcm", voice_bytes, "application/octet-stream")
+    files["data"] = (None, json.dumps({"uid": uid, "items": items}))
+    return files
+
+
+def send_heartbeat(session, url, uid, batch, scene_bytes, voice_bytes):
+    if batch > 1:
+        files = build_batch_payload(uid, batch, scene_bytes, voice_bytes)
+    else:
+        files = build_payload(uid, scene_bytes, voice_bytes)
+    start = time.time()
+    resp = session.post(url, files=files)
+    return time.time() - start, resp.status_code
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of `pid` and its children, Linux only."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = sum(int(x) for x in fields[11:15])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def run(url, num_requests, concurrency, num_users, batch, scene_bytes, voice_bytes, server_pid=None):
+    sessions = [requests.Session() for _ in range(concurrency)]
+    cpu_start = cpu_seconds(server_pid) if server_pid else None
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(
+                send_heartbeat,
+                sessions[i % concurrency],
+                url,
+                f"benchmark-{i % num_users}",
+                batch,
+                scene_bytes,
+                voice_bytes,
+            )
+            for i in range(num_requests)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.time() - start
+
+    latencies = np.array([cost for cost, _ in results]) * 1000
+    errors = len([code for _, code in results if code >= 400])
+    # every item stands for one second of wear time
+    wear_minutes = num_requests * batch / 60
+    res = {
+        "requests": num_requests,
+        "items": num_requests * batch,
+        "errors": errors,
+        "rps": round(num_requests / elapsed, 2),
+        "items_per_second": round(num_requests * batch / elapsed, 2),
+        "requests_per_wear_minute": round(num_requests / wear_minutes, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+    }
+    if server_pid:
+        cpu = cpu_seconds(server_pid) - cpu_start
+        res["server_cpu_s_per_wear_minute"] = round(cpu / wear_minutes, 4)
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://localhost:9527/heartbeat")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--scene_kb", type=int, default=60)
+    parser.add_argument("--voice_kb", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--server_pid", type=int, default=None)
+    args = parser.parse_args()
+
+    url = args.url
+    if args.batch > 1 and not url.endswith("/batch"):
+        url = url.rstrip("/") + "/batch"
+    res = run(
+        url,
+        args.requests,
+        args.concurrency,
+        args.users,
+        args.batch,
+        os.urandom(args.scene_kb * 1024),
+        os.urandom(args.voice_kb * 1024),
+        server_pid=args.server_pid,
+    )
+    print(json.dumps(res, indent=2))
@@ -0,0 +1,61 @@
+"""How often the response hedge fires and what it does to the time to first token.
+
+Reads the races recorded in `response_hedge$samples` by `tools/hedge.py`. The
+primary's own time to first token is known even when it lost, it is cancelled
+at its first token, so `primary_only` is what the user would have waited
+without the hedge. Turns the hedge rescued from a primary that never streamed
+count with the time the primary failed or timed out:
+
+    python scripts/hedge_report.py
+"""
+import json
+
+import numpy as np
+
+from tools.redis_client import RedisClientProxy
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    return {
+        "mean_ms": round(float(np.mean(values)), 1),
+        "p50_ms": round(float(np.percentile(values, 50)), 1),
+        "p99_ms": round(float(np.percentile(values, 99)), 1),
+    }
+
+
+def primary_wait(sample):
+    """What the user would have waited without the hedge.
+
+    A primary that never streamed kept the user waiting until it failed or
+    timed out, and then there was no answer at all.
+    """
+    if sample["primary_ttft"] is not None:
+        return sample["primary_ttft"]
+    return sample.get("primary_end")
+
+
+def report(samples):
+    hedged = [s for s in samples if s["hedged"]]
+    # the primary never streamed in these, the hedge was the only answer
+    rescued = [s for s in hedged if s["primary_ttft"] is None and s["ttft"] is not None]
+    turns = [s for s in samples if s["ttft"] is not None and primary_wait(s) is not None]
+    with_hedge = percentiles([s["ttft"] for s in turns])
+    primary_only = percentiles([primary_wait(s) for s in turns])
+    return {
+        "turns": len(samples),
+        "fire_rate": round(len(hedged) / len(samples), 3) if samples else None,
+        "secondary_won": sum(1 for s in hedged if s["winner"] == "secondary"),
+        "primary_never_streamed": len(rescued),
+        "with_hedge": with_hedge,
+        "primary_only": primary_only,
+        "p99_saved_ms": round(primary_only["p99_ms"] - with_hedge["p99_ms"], 1)
+        if with_hedge
+        else None,
+        "statistics": RedisClientProxy.get_queue_statistics("response_hedge"),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(report(RedisClientProxy.get_hedge_samples()), indent=2))
@@ -0,0 +1,94 @@
+"""Client-side overhead of an LLM call, per-call construction vs the registry.
+
+By default only the work done before the request is measured: building the
+model, the chain and the prompt. `--live` also sends `--calls` requests with
+each path, so that connection reuse shows up in the wall time:
+
+    python scripts/llm_overhead_benchmark.py --calls 200
+    python scripts/llm_overhead_benchmark.py --calls 20 --live
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from langchain.chains import LLMChain
+from langchain.chat_models import PromptLayerChatOpenAI
+from langchain.prompts.chat import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+
+from tools.llm import ChatModel
+from tools.openai_api import (
+    get_openai_api_key,
+    get_openai_chat_model,
+    get_openai_chatgpt,
+    openai_api_base_default,
+)
+
+SYSTEM_PROMPT = "You are a helpful assistant, answer in one word."
+USER_MSG = "Say hi."
+
+
+def chat_prompt():
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT),
+            HumanMessagePromptTemplate.from_template(USER_MSG),
+        ]
+    )
+
+
+def before(live: bool):
+    """What every caller did: a new model and a verbose chain per call."""
+    llm = PromptLayerChatOpenAI(
+        verbose=True,
+        openai_api_key=get_openai_api_key(),
+        openai_api_base=openai_api_base_default,
+        model_name=get_openai_chat_model(),
+        temperature=0.0,
+        pl_tags=["benchmark"],
+    )
+    chain = LLMChain(llm=llm, verbose=True, prompt=chat_prompt())
+    if live:
+        return chain.generate([{}]).generations[0]
+    return chain.prep_prompts([{}])
+
+
+def after(live: bool):
+    chat_model = ChatModel(llm=get_openai_chatgpt(temperature=0.0, pl_tags=["benchmark"]))
+    if live:
+        return chat_model.predict_with_msgs(chat_prompt(), use_cache=False)
+    return chat_prompt().format_prompt()
+
+
+def run(func, calls: int, live: bool):
+    costs = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func(live)
+        costs.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": round(float(np.mean(costs)), 3),
+        "p50_ms": round(float(np.percentile(costs, 50)), 3),
+        "p99_ms": round(float(np.percentile(costs, 99)), 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    print(
+        json.dumps(
+            {
+                "before": run(before, args.calls, args.live),
+                "after": run(after, args.calls, args.live),
+            },
+            indent=2,
+        )
+    )
@@ -17,3 +17,12 @@ SEARCH_REPORTER_PROMPT = """As an expert in reporting personal information, your
 
 [Report] Please summarize the relevant information based on the context.
 """
+
+AGENT_PLANNER_PROMPT = """As an expert in conversational strategy and in gathering personal information from user databases, your task is to analyze the context and, in one pass:
+1. define the objective of the conversation and design or refine the strategy plan for engaging in multi-turn conversations with the user;
+2. design or refine a search plan that collects the information about the user the plan needs, given the information already known;
+3. evaluate the conversation progress and determine an appropriate action to take in the strategy plan.
+
+Please output a JSON object only, in the following format:
+{{"plan": "[Plan] the objective and the strategy plan", "queries": ["one query statement per item, each focusing on a specific aspect of the user's personal information"], "action": "[Action] the evaluation and the action to take"}}
+"""
@@ -1,6 +1,7 @@
 import json
 import os
 import threading
+from typing import Callable, Optional
 
 from base.auditory import AuditoryContext
 from tools.log import logger
@@ -21,11 +22,13 @@ class AliRealTimeASR(NlsSpeechTranscriber):
             accessKeyId=accessKeyId,
             accessKeySecret=accessKeySecret,
             appKey=appKey,
+            on_partial_result: Optional[Callable[[str], None]] = None,
     ):
         self.__accessKeyId = accessKeyId
         self.__accessKeySecret = accessKeySecret
         self.__appKey = appKey
         self.__id = uid
+        self.on_partial_result = on_partial_result
         super().__init__(
             appkey=self.__appKey,
             token=getToken(self.__accessKeyId, self.__accessKeySecret),
@@ -87,6 +90,11 @@ class AliRealTimeASR(NlsSpeechTranscriber):
     def on_result_changed(self, message, *args):
         self.start_time = get_timestamp()
         logger.info("on_result_changed:{} {}".format(message, *args))
+        if self.on_partial_result is not None:
+            try:
+                self.on_partial_result(json.loads(message)["payload"]["result"])
+            except Exception as e:
+                logger.error("on_partial_result error:{}, {}".format(e, *args))
 
     def on_completed(self, message, *args):
         logger.info("on_completed:{} {}".format(message, *args))
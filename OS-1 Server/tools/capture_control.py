@@ -0,0 +1,147 @@
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from tools.log import logger
+from tools.redis_client import RedisClient
+
+# cadence the glasses capture at when the image workers keep up (ms)
+CAPTURE_BASE_INTERVAL = int(os.getenv("CAPTURE_BASE_INTERVAL", 1000))
+CAPTURE_MAX_INTERVAL = int(os.getenv("CAPTURE_MAX_INTERVAL", 10 * 1000))
+# longest side of the frame, stepped down as the image queue grows
+CAPTURE_RESOLUTIONS = [
+    int(x) for x in os.getenv("CAPTURE_RESOLUTIONS", "1280,960,640,480").split(",")
+]
+# seconds a frame may wait in `input_image` before the cadence slows down
+CAPTURE_TARGET_WAIT = float(os.getenv("CAPTURE_TARGET_WAIT", 2))
+# admission limits: frames waiting over all users, heartbeats in flight per process
+ADMISSION_MAX_IMAGE_DEPTH = int(os.getenv("ADMISSION_MAX_IMAGE_DEPTH", 2000))
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", 512))
+# seconds between two reads of the queue depth
+CAPTURE_REFRESH_INTERVAL = float(os.getenv("CAPTURE_REFRESH_INTERVAL", 1))
+# seconds between two reads of the worker statistics, as often as workers report
+CAPTURE_CAPACITY_INTERVAL = float(
+    os.getenv("CAPTURE_CAPACITY_INTERVAL", os.getenv("WORKER_REPORT_INTERVAL", 5))
+)
+# seconds without a heartbeat before the scene activity of a user is forgotten
+ACTIVITY_TTL = 5 * 60
+IMAGE_WORKER_PREFIX = "ImageWorker-"
+
+
+class SceneActivity:
+    """Moving average of how much the scene of a user changes between frames.
+
+    JPEG sizes follow the image content closely, so the relative size change
+    of consecutive frames is used as a free proxy instead of decoding them.
+    """
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.last_size = None
+        self.value = 1.0
+        self.updated_at = time.time()
+
+    def update(self, size: int) -> float:
+        if self.last_size is not None:
+            change = min(abs(size - self.last_size) / max(self.last_size, 1) * 10, 1.0)
+            self.value = self.alpha * change + (1 - self.alpha) * self.value
+        self.last_size = size
+        self.updated_at = time.time()
+        return self.value
+
+
+class CaptureController:
+    """Recommend a capture cadence per user and admit heartbeats.
+
+    The image backlog and the image worker capacity are refreshed in the
+    background, so a heartbeat only does in-memory arithmetic.
+    """
+
+    def __init__(self, redis_client: RedisClient):
+        self.redis_client = redis_client
+        self.image_depth = 0
+        # frames per second the healthy image workers can process
+        self.image_capacity = 0.0
+        self.inflight = 0
+        self.activities: Dict[str, SceneActivity] = {}
+        self.refresher = None
+        self.capacity_read_at = 0.0
+
+    async def start(self):
+        self.refresher = asyncio.create_task(self.refresh_forever())
+
+    async def stop(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+
+    def read_load(self):
+        depth = self.redis_client.get_image_queue_depth()
+        if time.time() - self.capacity_read_at < CAPTURE_CAPACITY_INTERVAL:
+            return depth, self.image_capacity
+        self.capacity_read_at = time.time()
+        capacity = 0.0
+        # statistics of dead workers expire, every field left is a live worker
+        for worker_id, value in self.redis_client.get_worker_statistics().items():
+            if not worker_id.startswith(IMAGE_WORKER_PREFIX):
+                continue
+            stats = json.loads(value)
+            if stats["busy_ratio"] <= 0:
+                continue
+            # items per busy second, what the worker would do if never idle
+            capacity += stats["throughput"] / stats["busy_ratio"]
+        return depth, capacity
+
+    async def refresh_forever(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                self.image_depth, self.image_capacity = await loop.run_in_executor(
+                    None, self.read_load
+                )
+                self.forget_inactive_users()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"CaptureController refresh error: {e}")
+            await asyncio.sleep(CAPTURE_REFRESH_INTERVAL)
+
+    def forget_inactive_users(self):
+        deadline = time.time() - ACTIVITY_TTL
+        for uid in [uid for uid, a in self.activities.items() if a.updated_at < deadline]:
+            del self.activities[uid]
+
+    def expected_wait(self) -> float:
+        """Seconds a new frame waits for an image worker."""
+        if self.image_capacity <= 0:
+            return math.inf if self.image_depth > 0 else 0.0
+        return self.image_depth / self.image_capacity
+
+    def retry_after(self) -> Optional[int]:
+        """Seconds to back off when an admission limit is hit, `None` to admit."""
+        if self.inflight >= ADMISSION_MAX_INFLIGHT:
+            return 1
+        if self.image_depth >= ADMISSION_MAX_IMAGE_DEPTH:
+            wait = self.expected_wait()
+            return int(min(max(wait, 1), CAPTURE_MAX_INTERVAL / 1000))
+        return None
+
+    def update_activity(self, uid: str, scene_size: Optional[int]) -> float:
+        if uid not in self.activities:
+            self.activities[uid] = SceneActivity()
+        if scene_size is None:
+            return self.activities[uid].value
+        return self.activities[uid].update(scene_size)
+
+    def recommend(self, uid: str, scene_size: Optional[int] = None) -> dict:
+        activity = self.update_activity(uid, scene_size)
+        load = max(self.expected_wait() / CAPTURE_TARGET_WAIT, 1.0)
+        # a static scene is sampled at up to half the cadence
+        interval = CAPTURE_BASE_INTERVAL * min(load, 1e3) * (2 - activity)
+        level = 0 if load <= 1 else int(math.log2(min(load, 1e3))) + 1
+        return {
+            "frame_interval": int(min(interval, CAPTURE_MAX_INTERVAL)),
+            "resolution": CAPTURE_RESOLUTIONS[min(level, len(CAPTURE_RESOLUTIONS) - 1)],
+        }
@@ -0,0 +1,179 @@
+import re
+from collections import defaultdict
+from typing import List, Optional
+
+try:
+    # installed with paddlespeech
+    import jieba
+except ImportError:
+    jieba = None
+
+# cues per source, as asked from the LLM by `MEMORY_QUERY_PROMPT_LLAMA`
+MAX_CUES = 5
+MAX_PHRASE_WORDS = 3
+
+STOPWORDS = set(
+    """
+    a about above after again against all am an and any are aren't as at be because
+    been before being below between both but by can can't cannot could couldn't did
+    didn't do does doesn't doing don't down during each few for from further had
+    hadn't has hasn't have haven't having he he'd he'll he's her here here's hers
+    herself him himself his how how's i i'd i'll i'm i've if in into is isn't it it's
+    its itself let's me more most mustn't my myself no nor not of off on once only or
+    other ought our ours ourselves out over own same shan't she she'd she'll she's
+    should shouldn't so some such than that that's the their theirs them themselves
+    then there there's these they they'd they'll they're they've this those through
+    to too under until up very was wasn't we we'd we'll we're we've were weren't what
+    what's when when's where where's which while who who's whom why why's with won't
+    would wouldn't you you'd you'll you're you've your yours yourself yourselves
+    also just really maybe yeah yes ok okay oh hi hello hey well like know think
+    want wanna gonna got get go going went come tell said say let thing things
+    something anything nothing lot bit kind sort sure right now today yesterday
+    tomorrow ago minute minutes hour hours day days week weeks month months year
+    years time still even much many one two three new good great last next
+    weekend morning afternoon evening night
+    see seen can could may might will shall must friend human samantha sam
+    """.split()
+)
+
+# boilerplate of `VisualContext.format`, carries nothing to search for
+CONTEXT_BOILERPLATE = re.compile(
+    r"We are in:|We can see:|My Friend may be|It looks like my friend is|"
+    r"I did not noticing anything special in my sight\.|"
+    r"I should focus on my human friend's words\.|"
+    # time prefix of `get_relative_time`
+    r"Today is [^.]*\.\s*It is .*? in \w+\.\s*Just [^,]*,",
+    re.IGNORECASE,
+)
+# function words of Chinese, no cue starts or ends with them
+ZH_STOPWORDS = set(
+    """
+    的 了 是 在 和 与 也 都 就 又 还 很 吗 呢 吧 啊 呀 哦 嗯 我 你 他 她 它 这 那 哪 有
+    不 没 没有 我们 你们 他们 她们 自己 什么 怎么 为什么 哪里 一个 一下 一些 这个 那个
+    这些 那些 这样 那样 然后 因为 所以 但是 可是 如果 就是 还是 或者 已经 现在 今天
+    昨天 明天 刚才 时候 知道 觉得 想 要 会 能 可以 说 去 来 看 做 给 让 被 把 对 跟
+    """.split()
+)
+ZH_STOP_CHARS = re.compile("[" + "".join(w for w in ZH_STOPWORDS if len(w) == 1) + "]")
+SPLIT_PATTERN = re.compile(r"[.,;:!?()\[\]{}\"\n，。；：！？、（）《》“”]")
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'\-]*|[\u4e00-\u9fff]+|\d+")
+CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+
+
+def is_cjk(word: str) -> bool:
+    return CJK_PATTERN.match(word) is not None
+
+
+def segment(run: str) -> List[str]:
+    """Words of a run of Chinese characters, which has no spaces between them.
+
+    Without jieba, every two characters not cut by a stopword make a word of
+    their own: coarse, but a cue is then no longer a whole clause. "" marks
+    the end of a phrase.
+    """
+    if jieba is not None:
+        return jieba.lcut(run)
+    words = []
+    for part in ZH_STOP_CHARS.split(run):
+        for i in range(max(len(part) - 1, 1) if part else 0):
+            words += [part[i : i + 2], ""]
+    return words
+
+
+def words_of(chunk: str) -> List[str]:
+    words = []
+    for word in WORD_PATTERN.findall(chunk):
+        words += segment(word) if is_cjk(word) else [word]
+    return words
+
+
+def join_words(words: List[str]) -> str:
+    """Words of a phrase, Chinese ones are written without spaces."""
+    res = words[0]
+    for prev, word in zip(words, words[1:]):
+        res += word if is_cjk(prev) and is_cjk(word) else " " + word
+    return res
+
+
+def candidate_phrases(text: str) -> List[List[str]]:
+    """Runs of content words, cut at stopwords and punctuation."""
+    phrases = []
+    for chunk in SPLIT_PATTERN.split(text):
+        phrase = []
+        for word in words_of(chunk) + [""]:
+            if (
+                word == ""
+                or word.isdigit()
+                or word.lower() in STOPWORDS
+                or word in ZH_STOPWORDS
+            ):
+                # long runs are split, a cue is a short keyword
+                for i in range(0, len(phrase), MAX_PHRASE_WORDS):
+                    phrases.append(phrase[i : i + MAX_PHRASE_WORDS])
+                phrase = []
+                continue
+            phrase.append(word)
+    return phrases
+
+
+def extract_keyphrases(text: Optional[str], k: int = MAX_CUES) -> List[str]:
+    """Top `k` keyphrases of `text`, scored as in RAKE.
+
+    A word scores its co-occurrence degree over its frequency, a phrase the
+    sum of its words, so that specific multi-word phrases rank first. Proper
+    nouns, capitalized inside a sentence, get a bonus. Chinese is segmented
+    by jieba if installed, into character bigrams otherwise.
+    """
+    if not text:
+        return []
+    phrases = candidate_phrases(text)
+    freq = defaultdict(int)
+    degree = defaultdict(int)
+    for phrase in phrases:
+        for word in phrase:
+            freq[word.lower()] += 1
+            degree[word.lower()] += len(phrase)
+
+    scores = {}
+    for phrase in phrases:
+        cue = join_words(phrase)
+        score = sum(degree[w.lower()] / freq[w.lower()] for w in phrase)
+        score += sum(1 for w in phrase[1:] if w[0].isupper())
+        # single short latin words are rarely worth a search
+        if len(phrase) == 1 and len(phrase[0]) < 3 and phrase[0].isascii():
+            continue
+        key = cue.lower()
+        if key not in scores or scores[key][0] < score:
+            scores[key] = (score, cue)
+    ranked = sorted(scores.values(), key=lambda item: item[0], reverse=True)
+    res = []
+    for _, cue in ranked:
+        # a word of a phrase already taken adds nothing to the search
+        if any(set(cue.lower().split()) <= set(item.lower().split()) for item in res):
+            continue
+        res.append(cue)
+        if len(res) >= k:
+            break
+    return res
+
+
+def human_lines(conversation: str, human_prefix: str = "Human") -> str:
+    """What the user said, the cues the LLM is asked for are the ones they refer to."""
+    lines = [
+        line[len(human_prefix) + 1 :]
+        for line in conversation.split("\n")
+        if line.startswith(f"{human_prefix}:")
+    ]
+    return "\n".join(lines) if len(lines) > 0 else conversation
+
+
+def extract_cues(conversation: str, context: Optional[str], k: int = MAX_CUES) -> List[str]:
+    """Memory cues of a turn, the local counterpart of `MEMORY_QUERY_PROMPT_LLAMA`."""
+    cues = extract_keyphrases(human_lines(conversation), k=k)
+    if context:
+        cues += extract_keyphrases(CONTEXT_BOILERPLATE.sub(".", context), k=k)
+    res = []
+    for cue in cues:
+        if cue.lower() not in [item.lower() for item in res]:
+            res.append(cue)
+    return res
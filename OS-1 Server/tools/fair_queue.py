@@ -0,0 +1,137 @@
+import os
+import time
+from typing import Optional
+
+import redis
+
+# credit a user earns per round, a user of weight `w` gets `w * quantum` items
+FAIR_QUANTUM = float(os.getenv("FAIR_QUANTUM", 1))
+# wake-ups kept for idle consumers, more pushes than this wake nobody new
+FAIR_WAKE_MAX = 1024
+
+# KEYS: sub-queue of the user, active users, ring of users, wake-ups
+# ARGV: uid, item, wake-ups kept
+PUSH_FAIR_LUA = """
+redis.call('RPUSH', KEYS[1], ARGV[2])
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+redis.call('RPUSH', KEYS[4], 1)
+redis.call('LTRIM', KEYS[4], 0, tonumber(ARGV[3]) - 1)
+"""
+
+# Deficit round robin over the ring of active users. The user is taken off
+# the ring here, a consumer dying between two calls would leave it active
+# but out of the ring, never served again.
+# KEYS: ring of users, active users, deficits, weights
+# ARGV: quantum, prefix of the sub-queues
+# the item, 0 when the user had no credit for it, nil when the ring is empty
+POP_FAIR_LUA = """
+local uid = redis.call('LPOP', KEYS[1])
+if not uid then
+    return false
+end
+local queue = ARGV[2] .. uid
+local weight = tonumber(redis.call('HGET', KEYS[4], uid) or '1')
+local deficit = tonumber(redis.call('HGET', KEYS[3], uid) or '0')
+if deficit < 1 then
+    deficit = deficit + tonumber(ARGV[1]) * weight
+end
+if deficit < 1 then
+    -- not enough credit for one item, wait for the next round
+    redis.call('HSET', KEYS[3], uid, deficit)
+    redis.call('RPUSH', KEYS[1], uid)
+    return 0
+end
+local item = redis.call('LPOP', queue)
+deficit = deficit - 1
+if redis.call('LLEN', queue) == 0 then
+    redis.call('SREM', KEYS[2], uid)
+    redis.call('HDEL', KEYS[3], uid)
+elseif deficit >= 1 then
+    -- credit left, serve the same user next
+    redis.call('HSET', KEYS[3], uid, deficit)
+    redis.call('LPUSH', KEYS[1], uid)
+else
+    redis.call('HSET', KEYS[3], uid, deficit)
+    redis.call('RPUSH', KEYS[1], uid)
+end
+return item or 0
+"""
+
+
+def fair_queue_keys(queue: str, uid: str) -> list:
+    """Keys of PUSH_FAIR_LUA."""
+    base = f"{queue}_fair"
+    return [
+        f"{base}${uid}",
+        f"{base}$active",
+        base,
+        f"{base}$wake",
+    ]
+
+
+class FairQueue:
+    """Per-user sub-queues of `queue` served by deficit round robin.
+
+    A user flooding the queue only delays its own items: every active user
+    gets `weight * FAIR_QUANTUM` items per round, in the order users became
+    active.
+    """
+
+    def __init__(self, redis_client: redis.StrictRedis, queue: str, quantum=FAIR_QUANTUM):
+        self.redis_client = redis_client
+        self.queue = queue
+        self.quantum = quantum
+        self.push_script = redis_client.register_script(PUSH_FAIR_LUA)
+        self.pop_script = redis_client.register_script(POP_FAIR_LUA)
+
+    def keys(self, uid: str) -> list:
+        return fair_queue_keys(self.queue, uid)
+
+    def push(self, uid: str, data):
+        self.push_script(keys=self.keys(uid), args=[uid, data, FAIR_WAKE_MAX])
+
+    def pop_once(self):
+        """The next item, 0 when a user was passed over for lack of credit."""
+        base = f"{self.queue}_fair"
+        return self.pop_script(
+            keys=[base, f"{base}$active", f"{base}$deficit", f"{base}$weight"],
+            args=[self.quantum, f"{base}$"],
+        )
+
+    def pop(self, timeout=None):
+        """Block up to `timeout` seconds, `None` pops without blocking.
+
+        Consumers only block on the wake-ups, the ring is never popped outside
+        of POP_FAIR_LUA. A stale wake-up costs one more empty pop.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            data = self.pop_once()
+            if data == 0:
+                continue
+            if data is not None:
+                return data
+            remaining = 0 if deadline is None else deadline - time.time()
+            if remaining <= 0:
+                return None
+            self.redis_client.blpop(self.keys("")[3], timeout=max(remaining, 0.01))
+
+    def set_weight(self, uid: str, weight: float):
+        # a user without weight would never earn credit, and be passed over forever
+        if weight <= 0:
+            raise ValueError(f"weight of {uid} must be positive, got {weight}")
+        self.redis_client.hset(f"{self.queue}_fair$weight", uid, weight)
+
+    def get_weight(self, uid: str) -> float:
+        weight = self.redis_client.hget(f"{self.queue}_fair$weight", uid)
+        return 1.0 if weight is None else float(weight)
+
+    def length(self) -> int:
+        """Items waiting over all users."""
+        users = self.redis_client.smembers(self.keys("")[1])
+        pipe = self.redis_client.pipeline(transaction=False)
+        for uid in users:
+            pipe.llen(self.keys(uid.decode("utf-8"))[0])
+        return sum(pipe.execute())
@@ -0,0 +1,125 @@
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+# `idt` (default): dispersion threshold; `ivt`: velocity threshold
+FIXATION_METHOD = os.getenv("FIXATION_METHOD", "idt")
+# ms a gaze has to stay still to count as a fixation
+FIXATION_MIN_DURATION = int(os.getenv("FIXATION_MIN_DURATION", 100))
+# I-DT: max (x range + y range) of a fixation, in normalized image units
+FIXATION_DISPERSION = float(os.getenv("FIXATION_DISPERSION", 0.05))
+# I-VT: max gaze speed of a fixation, in normalized image units per second
+FIXATION_VELOCITY = float(os.getenv("FIXATION_VELOCITY", 1.0))
+# ms between the end of a fixation and the frame for it to still count
+FIXATION_TOLERANCE = int(os.getenv("FIXATION_TOLERANCE", 200))
+
+
+@dataclass
+class Fixation:
+    start: int
+    end: int
+    x: float
+    y: float
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def to_samples(gazes: List[dict]) -> np.ndarray:
+    """`(n, 3)` array of `timestamp, norm_pos_x, norm_pos_y` sorted by time."""
+    if len(gazes) == 0:
+        return np.empty((0, 3))
+    samples = np.array(
+        [[g["timestamp"], g["norm_pos_x"], g["norm_pos_y"]] for g in gazes],
+        dtype=np.float64,
+    )
+    samples = samples[np.argsort(samples[:, 0], kind="stable")]
+    # the same gaze can be sent by two heartbeats
+    keep = np.concatenate(([True], np.diff(samples[:, 0]) > 0))
+    return samples[keep]
+
+
+def mask_to_fixations(samples: np.ndarray, mask: np.ndarray, min_duration) -> List[Fixation]:
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    fixations = []
+    for start, end in zip(starts, ends):
+        if samples[end, 0] - samples[start, 0] < min_duration:
+            continue
+        x, y = samples[start : end + 1, 1:].mean(axis=0)
+        fixations.append(
+            Fixation(int(samples[start, 0]), int(samples[end, 0]), float(x), float(y))
+        )
+    return fixations
+
+
+def detect_ivt(
+    samples: np.ndarray,
+    velocity=FIXATION_VELOCITY,
+    min_duration=FIXATION_MIN_DURATION,
+) -> List[Fixation]:
+    if len(samples) < 2:
+        return []
+    dt = np.diff(samples[:, 0]) / 1000
+    speed = np.hypot(*np.diff(samples[:, 1:], axis=0).T) / dt
+    slow = speed < velocity
+    # the speed of a sample is the one it is reached with
+    mask = np.concatenate((slow[:1], slow))
+    return mask_to_fixations(samples, mask, min_duration)
+
+
+def detect_idt(
+    samples: np.ndarray,
+    dispersion=FIXATION_DISPERSION,
+    min_duration=FIXATION_MIN_DURATION,
+) -> List[Fixation]:
+    n = len(samples)
+    if n < 2:
+        return []
+    t, x, y = samples[:, 0], samples[:, 1], samples[:, 2]
+    # the window of sample i spans back to the last sample `min_duration` earlier
+    starts = np.searchsorted(t, t - min_duration, side="right") - 1
+    valid = starts >= 0
+    starts = np.clip(starts, 0, None)
+
+    # max / min over every [starts[i], i] window in one reduceat call each
+    bounds = np.empty(2 * n, dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = np.arange(1, n + 1)
+    x_ext, y_ext = np.append(x, x[-1]), np.append(y, y[-1])
+    spread = (
+        np.maximum.reduceat(x_ext, bounds)[0::2]
+        - np.minimum.reduceat(x_ext, bounds)[0::2]
+        + np.maximum.reduceat(y_ext, bounds)[0::2]
+        - np.minimum.reduceat(y_ext, bounds)[0::2]
+    )
+    still = valid & (spread <= dispersion)
+
+    # every sample inside a still window belongs to the fixation
+    cover = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(cover, starts[still], 1)
+    np.add.at(cover, np.flatnonzero(still) + 1, -1)
+    mask = np.cumsum(cover[:-1]) > 0
+    return mask_to_fixations(samples, mask, min_duration)
+
+
+def detect_fixations(samples: np.ndarray, method=FIXATION_METHOD) -> List[Fixation]:
+    if method == "ivt":
+        return detect_ivt(samples)
+    return detect_idt(samples)
+
+
+def current_fixation(
+    gazes: List[dict], now: int, tolerance=FIXATION_TOLERANCE
+) -> Optional[Fixation]:
+    """The fixation the wearer is in at `now` (gaze clock), if any."""
+    samples = to_samples(gazes)
+    samples = samples[samples[:, 0] <= now]
+    fixations = detect_fixations(samples)
+    if len(fixations) == 0 or fixations[-1].end < now - tolerance:
+        return None
+    return fixations[-1]
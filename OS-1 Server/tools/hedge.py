@@ -0,0 +1,170 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+from typing import Any, Callable, Dict, Optional
+
+from tools.log import logger
+from tools.openai_api import StreamingCallbackHandlerWithRedis, UserInterrupt
+from tools.redis_client import RedisClientProxy
+
+PRIMARY = "primary"
+SECONDARY = "secondary"
+
+
+class HedgeCancelled(Exception):
+    """Raised in the stream of the request that lost the race."""
+
+
+class HedgeRace:
+    """Requests racing for one reply, the first to stream a token wins.
+
+    Records the time to first token of each request, so that a turn also
+    says how long the primary alone would have kept the user waiting.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.start = time.time()
+        self.cond = Condition()
+        self.winner: Optional[str] = None
+        # name -> ms to the first token, None if it never came
+        self.first_tokens: Dict[str, Optional[int]] = {}
+        # name -> ms to the end of the request, streamed or not
+        self.ends: Dict[str, int] = {}
+        self.futures = {}
+        # no request joins once closed, the race is recorded when all are done
+        self.closed = False
+        self.recorded = False
+
+    def claim(self, name: str) -> bool:
+        with self.cond:
+            if self.first_tokens.get(name) is None:
+                self.first_tokens[name] = int((time.time() - self.start) * 1000)
+            if self.winner is None:
+                self.winner = name
+                self.cond.notify_all()
+            return self.winner == name
+
+    def submit(self, pool: ThreadPoolExecutor, name: str, func: Callable):
+        with self.cond:
+            self.first_tokens.setdefault(name, None)
+            future = pool.submit(func)
+            self.futures[name] = future
+        future.add_done_callback(lambda _: self.on_done(name))
+        return future
+
+    def on_done(self, name: Optional[str] = None):
+        with self.cond:
+            if name is not None:
+                self.ends[name] = int((time.time() - self.start) * 1000)
+            self.cond.notify_all()
+            if self.recorded or not self.closed:
+                return
+            if not all(future.done() for future in self.futures.values()):
+                return
+            self.recorded = True
+        self.record()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+        self.on_done()
+
+    def wait_primary(self, delay: float) -> bool:
+        """Wait up to `delay` seconds for the primary, True if it streamed or ended."""
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: self.winner is not None or self.futures[PRIMARY].done(),
+                timeout=delay,
+            )
+
+    def wait_winner(self) -> Optional[str]:
+        """Name of the request that streamed first, or that answered first without streaming."""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.winner is not None
+                or all(future.done() for future in self.futures.values())
+            )
+            if self.winner is not None:
+                return self.winner
+        for name, future in self.futures.items():
+            if future.exception() is None:
+                return name
+        return PRIMARY
+
+    def record(self):
+        hedged = SECONDARY in self.futures
+        ttft = self.first_tokens.get(self.winner) if self.winner else None
+        sample = {
+            "hedged": hedged,
+            "winner": self.winner,
+            "ttft": ttft,
+            "primary_ttft": self.first_tokens.get(PRIMARY),
+            # when the primary failed or timed out without a token
+            "primary_end": self.ends.get(PRIMARY),
+        }
+        try:
+            RedisClientProxy.incr_queue_statistic("response_hedge", "turns")
+            if hedged:
+                RedisClientProxy.incr_queue_statistic("response_hedge", "fired")
+                RedisClientProxy.incr_queue_statistic("response_hedge", f"{self.winner}_won")
+            RedisClientProxy.push_hedge_sample(json.dumps(sample))
+        except Exception as e:
+            logger.error(f"hedge record error for {self.user_id}: {e}")
+        logger.info(f"hedge race of {self.user_id}: {sample}")
+
+
+class HedgedStreamingCallbackHandler(StreamingCallbackHandlerWithRedis):
+    """Streams to the user only once its request won the race."""
+
+    def __init__(self, race: HedgeRace, name: str, user_id: str, interruptable: bool = False):
+        super().__init__(user_id=user_id, interruptable=interruptable)
+        self.race = race
+        self.name = name
+        # a callback error is only logged by langchain unless it is raised
+        self.raise_error = True
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token == "":
+            return
+        if not self.race.claim(self.name):
+            raise HedgeCancelled(self.name)
+        super().on_llm_new_token(token, **kwargs)
+
+
+def run_hedged(
+    race: HedgeRace,
+    primary: Callable,
+    secondary: Optional[Callable],
+    delay: float,
+):
+    """Result of the request that streams first.
+
+    `secondary` is fired once `primary` streamed nothing for `delay` seconds,
+    or at once if it failed before its first token. The loser is cancelled
+    at its first token, a request is not interrupted before that.
+    """
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        primary_future = race.submit(pool, PRIMARY, primary)
+        race.wait_primary(delay)
+        fallback = primary_future.done() and not isinstance(
+            primary_future.exception(), (type(None), UserInterrupt)
+        )
+        if secondary is not None and race.winner is None and (
+            not primary_future.done() or fallback
+        ):
+            if fallback:
+                RedisClientProxy.incr_queue_statistic("response_hedge", "fallback")
+            logger.info(
+                f"hedge fired for {race.user_id}: "
+                f"{'primary failed' if fallback else f'no token in {delay}s'}"
+            )
+            race.submit(pool, SECONDARY, secondary)
+        race.close()
+        winner = race.wait_winner()
+        return winner, race.futures[winner].result()
+    finally:
+        # the loser ends at its next token, nobody waits for it
+        pool.shutdown(wait=False)
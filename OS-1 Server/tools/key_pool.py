@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+from tools.log import logger
+
+# limits a key starts with, until the response headers tell its real ones
+KEY_POOL_RPM = int(os.getenv("KEY_POOL_RPM", 3500))
+KEY_POOL_TPM = int(os.getenv("KEY_POOL_TPM", 90000))
+# seconds a throttled key is left out when the API does not say how long
+KEY_POOL_COOLDOWN = float(os.getenv("KEY_POOL_COOLDOWN", 10))
+# seconds between two reports of the pool statistics to Redis
+KEY_POOL_REPORT_INTERVAL = float(os.getenv("KEY_POOL_REPORT_INTERVAL", 10))
+# tokens a request is assumed to take until its usage is known
+ESTIMATED_TOKENS = 1000
+
+DURATION_PATTERN = re.compile(r"([\d.]+)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of "20ms", "1.5s", "6m0s" as in `x-ratelimit-reset-*`, or of "3"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if len(parts) == 0:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    """`capacity` per minute, refilled continuously."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.level = min(
+            self.capacity, self.level + (now - self.updated_at) * self.capacity / 60
+        )
+        self.updated_at = now
+
+    def take(self, amount: float):
+        self.refill()
+        self.level -= amount
+
+    def set(self, capacity: Optional[float] = None, level: Optional[float] = None):
+        self.refill()
+        if capacity is not None:
+            self.capacity = capacity
+        if level is not None:
+            self.level = level
+
+    @property
+    def utilization(self) -> float:
+        self.refill()
+        return 1 - max(self.level, 0) / self.capacity if self.capacity > 0 else 1.0
+
+
+class ApiKey:
+    def __init__(self, key: str, base: Optional[str] = None):
+        self.key = key
+        self.base = base
+        # never log a key, its last characters are enough to tell them apart
+        self.name = f"...{key[-4:]}" if key else "none"
+        self.requests = TokenBucket(KEY_POOL_RPM)
+        self.tokens = TokenBucket(KEY_POOL_TPM)
+        self.throttled_until = 0.0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.total_throttles = 0
+
+    @property
+    def load(self) -> float:
+        return max(self.requests.utilization, self.tokens.utilization)
+
+    @property
+    def throttled(self) -> bool:
+        return self.throttled_until > time.time()
+
+    def statistics(self) -> dict:
+        return {
+            "base": self.base,
+            "rpm_limit": self.requests.capacity,
+            "tpm_limit": self.tokens.capacity,
+            "rpm_utilization": round(self.requests.utilization, 3),
+            "tpm_utilization": round(self.tokens.utilization, 3),
+            "throttled": self.throttled,
+            "requests": self.total_requests,
+            "tokens": self.total_tokens,
+            "throttles": self.total_throttles,
+        }
+
+
+class KeyPool:
+    """API keys of a model family, routed to the least loaded one.
+
+    Each key has token buckets for requests and tokens per minute, started
+    from defaults and corrected with the `x-ratelimit-*` headers of its
+    responses. A key answered with 429 is left out until it resets.
+    """
+
+    def __init__(self, name: str, entries: List[str], redis_client=None):
+        self.name = name
+        self.redis_client = redis_client
+        self.keys: Dict[str, ApiKey] = {}
+        for entry in entries:
+            # `key` or `key|base_url` for a key of another endpoint
+            key, _, base = entry.strip().partition("|")
+            self.keys[key] = ApiKey(key, base or None)
+        self.lock = Lock()
+        self.reported_at = 0.0
+
+    def acquire(self) -> ApiKey:
+        with self.lock:
+            keys = list(self.keys.values())
+            available = [key for key in keys if not key.throttled]
+            if len(available) == 0:
+                # all throttled, the first one back
+                key = min(keys, key=lambda k: k.throttled_until)
+            else:
+                key = min(available, key=lambda k: k.load)
+            key.requests.take(1)
+            key.tokens.take(ESTIMATED_TOKENS)
+            key.total_requests += 1
+        return key
+
+    def release(self, key: ApiKey):
+        """Give back what `acquire` took, for a request that never got an answer."""
+        with self.lock:
+            key.requests.take(-1)
+            key.tokens.take(-ESTIMATED_TOKENS)
+
+    def on_response(self, key: ApiKey, status: int, headers: dict, usage: Optional[dict]):
+        with self.lock:
+            # a streamed response has no usage, the estimate stays
+            if usage is not None:
+                tokens = usage.get("total_tokens", 0)
+                key.total_tokens += tokens
+                key.tokens.take(tokens - ESTIMATED_TOKENS)
+            # the headers are the truth, the buckets only an estimate
+            for bucket, name in ((key.requests, "requests"), (key.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{name}")
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                bucket.set(
+                    capacity=float(limit) if limit else None,
+                    level=float(remaining) if remaining else None,
+                )
+            if status == 429:
+                wait = (
+                    parse_duration(headers.get("retry-after"))
+                    or max(
+                        parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                        parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+                    )
+                    or KEY_POOL_COOLDOWN
+                )
+                key.throttled_until = time.time() + wait
+                key.total_throttles += 1
+                logger.warning(f"{self.name} key {key.name} throttled for {wait:.1f}s")
+        self.report()
+
+    def statistics(self) -> dict:
+        with self.lock:
+            return {key.name: key.statistics() for key in self.keys.values()}
+
+    def report(self):
+        if self.redis_client is None or time.time() - self.reported_at < KEY_POOL_REPORT_INTERVAL:
+            return
+        self.reported_at = time.time()
+        try:
+            self.redis_client.set(
+                f"key_pool_statistic${self.name}${os.getpid()}",
+                json.dumps(self.statistics()),
+                timeout=int(KEY_POOL_REPORT_INTERVAL * 6),
+            )
+        except Exception as e:
+            logger.error(f"{self.name} key pool report error: {e}")
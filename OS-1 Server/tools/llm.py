@@ -1,4 +1,3 @@
-from langchain.chains import LLMChain
 from langchain.chat_models.base import BaseChatModel
 from langchain.prompts.chat import (
     ChatPromptTemplate,
@@ -6,25 +5,68 @@ from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
     AIMessagePromptTemplate,
 )
+from langchain.schema import AIMessage, ChatGeneration, Generation
+
+from tools.llm_cache import LLMCacheProxy, cache_key, is_cacheable
+from tools.llm_scheduler import LLMSchedulerProxy
 
 
 class ChatModel:
-    def __init__(self, llm: BaseChatModel):
+    """Calls the model directly, an `LLMChain` per call only added overhead.
+
+    Answers of calls that are not streamed nor sampled hot are cached by
+    content, `use_cache=False` opts a call out. `caller` names the hit rates,
+    the first PromptLayer tag by default.
+
+    Calls wait for a slot of `priority`, `interactive` or `background`, the
+    class of the process by default.
+    """
+
+    def __init__(self, llm: BaseChatModel, caller: str = None, priority: str = None):
         self.llm = llm
+        pl_tags = getattr(llm, "pl_tags", None)
+        self.caller = caller or (pl_tags[0] if pl_tags else type(llm).__name__)
+        self.priority = priority
 
-    def predict_with_msgs(self, chat_prompt: ChatPromptTemplate):
-        chatbot = LLMChain(
-            llm=self.llm,
-            verbose=True,
-            prompt=chat_prompt,
-        )
-        return chatbot.generate([{}]).generations[0]
+    def predict_with_msgs(self, chat_prompt: ChatPromptTemplate, use_cache=True):
+        return self.predict_with_template(chat_prompt, use_cache=use_cache)
+
+    def predict_with_template(
+        self, chat_prompt: ChatPromptTemplate, use_cache=True, **inputs
+    ):
+        """`chat_prompt` may be a template built once and filled with `inputs`."""
+        prompt = chat_prompt.format_prompt(**inputs)
+        if not use_cache or not is_cacheable(self.llm):
+            return self.generate(prompt)
+        key = cache_key(self.llm, prompt.to_messages())
+        texts = LLMCacheProxy.get(key, self.caller)
+        if texts is not None:
+            return self.to_generations(texts)
+        generations = self.generate(prompt)
+        LLMCacheProxy.put(key, [generation.text for generation in generations])
+        return generations
+
+    def generate(self, prompt):
+        with LLMSchedulerProxy.slot(self.caller, self.priority):
+            return self.llm.generate_prompt([prompt]).generations[0]
+
+    def to_generations(self, texts):
+        if isinstance(self.llm, BaseChatModel):
+            return [ChatGeneration(message=AIMessage(content=text)) for text in texts]
+        return [Generation(text=text) for text in texts]
+
+    async def apredict_with_msgs(self, chat_prompt: ChatPromptTemplate, **inputs):
+        prompt = chat_prompt.format_prompt(**inputs)
+        async with LLMSchedulerProxy.aslot(self.caller, self.priority):
+            res = await self.llm.agenerate_prompt([prompt])
+        return res.generations[0]
 
-    def predict_with_prompt(self, prompt: str):
+    def predict_with_prompt(self, prompt: str, use_cache=True):
         return self.predict_with_msgs(
             chat_prompt=ChatPromptTemplate.from_messages(
                 [SystemMessagePromptTemplate.from_template(prompt)]
-            )
+            ),
+            use_cache=use_cache,
         )[0].text
 
 
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional
+
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+
+# `on` (default): reuse the answer of a byte-identical call
+LLM_CACHE = os.getenv("LLM_CACHE", "on")
+# seconds an answer is kept in Redis, answers kept in each process
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 24 * 60 * 60))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1024))
+# calls sampled hotter than this are not cached, their answers are meant to vary
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0.0))
+
+# settings of the model that change its answer
+MODEL_PARAMS = [
+    "model_name",
+    "temperature",
+    "max_tokens",
+    "n",
+    "top_p",
+    "stop",
+    "url",
+    "max_new_tokens",
+    "resp_prefix",
+]
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace does not change what is asked, it should not miss the cache."""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(llm, messages: list) -> str:
+    params = {name: getattr(llm, name) for name in MODEL_PARAMS if hasattr(llm, name)}
+    model_kwargs = getattr(llm, "model_kwargs", None)
+    if model_kwargs:
+        params["model_kwargs"] = model_kwargs
+    digest = hashlib.sha256()
+    digest.update(type(llm).__name__.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    for message in messages:
+        digest.update(f"\0{message.type}\0{normalize_text(message.content)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def is_cacheable(llm) -> bool:
+    if LLM_CACHE != "on" or getattr(llm, "streaming", False):
+        # streamed tokens go to the user as they come
+        return False
+    return (getattr(llm, "temperature", 0) or 0) <= LLM_CACHE_MAX_TEMPERATURE
+
+
+class LLMCache:
+    """Answers of LLM calls by content hash, in process then in Redis.
+
+    Hits and misses are counted per caller in `queue_statistic$llm_cache`.
+    """
+
+    def __init__(self, redis_client, size: int = LLM_CACHE_SIZE, ttl: int = LLM_CACHE_TTL):
+        self.redis_client = redis_client
+        self.size = size
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: str, caller: str) -> Optional[List[str]]:
+        with self.lock:
+            texts = self.local.get(key)
+            if texts is not None:
+                self.local.move_to_end(key)
+        tier = "local"
+        if texts is None:
+            tier = "redis"
+            try:
+                value = self.redis_client.get(f"llm_cache${key}")
+            except Exception as e:
+                logger.error(f"llm cache get error: {e}")
+                value = None
+            if value is not None:
+                texts = json.loads(value)
+                self.put_local(key, texts)
+        try:
+            self.redis_client.incr_queue_statistic(
+                "llm_cache", f"{caller}_{tier}_hit" if texts is not None else f"{caller}_miss"
+            )
+        except Exception as e:
+            logger.error(f"llm cache statistic error: {e}")
+        return texts
+
+    def put(self, key: str, texts: List[str]):
+        self.put_local(key, texts)
+        try:
+            self.redis_client.set(f"llm_cache${key}", json.dumps(texts), timeout=self.ttl)
+        except Exception as e:
+            logger.error(f"llm cache put error: {e}")
+
+    def put_local(self, key: str, texts: List[str]):
+        with self.lock:
+            self.local[key] = texts
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+
+LLMCacheProxy = LLMCache(RedisClientProxy)
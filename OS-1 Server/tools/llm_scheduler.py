@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+
+# `on` (default): LLM calls of every process take a slot of their class first
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "on")
+# calls of each class in flight at once, across processes
+LLM_INTERACTIVE_CONCURRENCY = int(os.getenv("LLM_INTERACTIVE_CONCURRENCY", 16))
+LLM_BACKGROUND_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_CONCURRENCY", 4))
+# background calls in flight while live turns are, so they keep moving
+LLM_BACKGROUND_BUSY_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_BUSY_CONCURRENCY", 1))
+# seconds a call waits for a slot before it goes anyway
+LLM_INTERACTIVE_MAX_WAIT = float(os.getenv("LLM_INTERACTIVE_MAX_WAIT", 10))
+LLM_BACKGROUND_MAX_WAIT = float(os.getenv("LLM_BACKGROUND_MAX_WAIT", 300))
+# seconds a slot is held at most, the slot of a crashed process frees itself
+LLM_SCHEDULER_LEASE = int(os.getenv("LLM_SCHEDULER_LEASE", 300))
+LLM_SCHEDULER_POLL = float(os.getenv("LLM_SCHEDULER_POLL", 0.05))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = {
+    INTERACTIVE: (LLM_INTERACTIVE_CONCURRENCY, LLM_INTERACTIVE_MAX_WAIT),
+    BACKGROUND: (LLM_BACKGROUND_CONCURRENCY, LLM_BACKGROUND_MAX_WAIT),
+}
+
+# KEYS: slots of the class, slots of live turns, live turns waiting
+# ARGV: token, now, expiry of the slot, cap, class, cap while live turns run
+# 1: slot taken; 0: class full; -1: yielded to a live turn
+ACQUIRE_SLOT_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local cap = tonumber(ARGV[4])
+if ARGV[5] == 'background' then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[2])
+    if redis.call('ZCARD', KEYS[3]) > 0 then
+        return -1
+    end
+    if redis.call('ZCARD', KEYS[2]) > 0 then
+        cap = math.min(cap, tonumber(ARGV[6]))
+    end
+end
+if redis.call('ZCARD', KEYS[1]) >= cap then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+return 1
+"""
+
+# the class of the calls of this process, the cron tasks run in the background
+default_priority = INTERACTIVE
+
+
+def set_default_priority(priority: str):
+    global default_priority
+    default_priority = priority
+
+
+def slot_keys(priority: str) -> list:
+    return [
+        f"llm_scheduler${priority}",
+        f"llm_scheduler${INTERACTIVE}",
+        "llm_scheduler$waiting",
+    ]
+
+
+class LLMScheduler:
+    """Slots for LLM calls, shared by the processes through Redis.
+
+    Live turns and background jobs have their own concurrency caps. A queued
+    background call yields to any waiting live turn, and fewer background
+    calls run while live turns do. Waits are counted per class in
+    `queue_statistic$llm_scheduler`.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.acquire_slot = redis_client.get_client().register_script(ACQUIRE_SLOT_LUA)
+
+    def try_acquire(self, priority: str, token: str) -> int:
+        cap = PRIORITIES[priority][0]
+        now = int(time.time() * 1000)
+        client = self.redis_client.get_client()
+        if priority == INTERACTIVE:
+            # seen by background calls for as long as it keeps polling
+            client.zadd("llm_scheduler$waiting", {token: now + 1000})
+        return int(
+            self.acquire_slot(
+                keys=slot_keys(priority),
+                args=[
+                    token,
+                    now,
+                    now + LLM_SCHEDULER_LEASE * 1000,
+                    cap,
+                    priority,
+                    LLM_BACKGROUND_BUSY_CONCURRENCY,
+                ],
+            )
+        )
+
+    def release(self, priority: str, token: str):
+        pipe = self.redis_client.get_client().pipeline(transaction=False)
+        pipe.zrem(f"llm_scheduler${priority}", token)
+        pipe.zrem("llm_scheduler$waiting", token)
+        pipe.execute()
+
+    def record(self, priority: str, caller: str, start: float, preempted: bool):
+        wait = int((time.time() - start) * 1000)
+        try:
+            self.redis_client.incr_queue_statistic("llm_scheduler", f"{priority}_calls")
+            self.redis_client.incr_queue_statistic("llm_scheduler", f"{priority}_wait_ms", wait)
+            if preempted:
+                self.redis_client.incr_queue_statistic("llm_scheduler", f"{priority}_preempted")
+        except Exception as e:
+            logger.error(f"llm scheduler error: {e}")
+        if wait > 1000:
+            logger.info(f"llm call of {caller} ({priority}) waited {wait}ms for a slot")
+
+    def wait_step(self, priority: str, token: str, start: float) -> tuple:
+        """(done, preempted) of one attempt, done once a slot is taken or waited too long."""
+        try:
+            res = self.try_acquire(priority, token)
+        except Exception as e:
+            logger.error(f"llm scheduler error: {e}")
+            return True, False
+        if res == 1:
+            return True, False
+        if time.time() - start > PRIORITIES[priority][1]:
+            logger.warning(f"llm call ({priority}) gave up waiting for a slot")
+            return True, res == -1
+        return False, res == -1
+
+    @contextmanager
+    def slot(self, caller: str, priority: str = None):
+        priority = priority or default_priority
+        if LLM_SCHEDULER != "on":
+            yield
+            return
+        token = uuid.uuid4().hex
+        start = time.time()
+        preempted = False
+        while True:
+            done, yielded = self.wait_step(priority, token, start)
+            preempted = preempted or yielded
+            if done:
+                break
+            time.sleep(LLM_SCHEDULER_POLL)
+        self.record(priority, caller, start, preempted)
+        try:
+            yield
+        finally:
+            try:
+                self.release(priority, token)
+            except Exception as e:
+                logger.error(f"llm scheduler error: {e}")
+
+    @asynccontextmanager
+    async def aslot(self, caller: str, priority: str = None):
+        priority = priority or default_priority
+        if LLM_SCHEDULER != "on":
+            yield
+            return
+        # the Redis round trips run on the executor, the event loop keeps serving
+        loop = asyncio.get_running_loop()
+        token = uuid.uuid4().hex
+        start = time.time()
+        preempted = False
+        while True:
+            done, yielded = await loop.run_in_executor(
+                None, self.wait_step, priority, token, start
+            )
+            preempted = preempted or yielded
+            if done:
+                break
+            await asyncio.sleep(LLM_SCHEDULER_POLL)
+        await loop.run_in_executor(None, self.record, priority, caller, start, preempted)
+        try:
+            yield
+        finally:
+            try:
+                await loop.run_in_executor(None, self.release, priority, token)
+            except Exception as e:
+                logger.error(f"llm scheduler error: {e}")
+
+
+LLMSchedulerProxy = LLMScheduler(RedisClientProxy)
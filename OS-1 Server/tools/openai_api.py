@@ -1,10 +1,14 @@
 import os
 import random
 from multiprocessing import Queue
+from threading import Lock
 from typing import Any, Union
 import json
 
+import openai as openai_sdk
 import promptlayer
+import requests
+from requests.adapters import HTTPAdapter
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.chat_models import PromptLayerChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
@@ -13,6 +17,7 @@ from langchain.schema import LLMResult
 from base.message import Message
 from tools.embedding_api import CustomEmbeddings
 from tools.helper import TextHelper
+from tools.key_pool import KeyPool
 from tools.redis_client import RedisClientProxy, UserStatus
 from tools.time_fmt import get_timestamp
 from langchain.embeddings import HuggingFaceEmbeddings
@@ -22,18 +27,25 @@ openai = promptlayer.openai
 
 # 实际使用时,在系统中设置环境变量
 openai_api_base_default = os.getenv("OPENAI_API_BASE_URL")
-openai_api_keys = [os.getenv("OPENAI_API_KEY")]
-gpt4_api_keys = [os.getenv("OPENAI_API_KEY")]
+# several keys, or `key|base_url` entries, are comma separated
+openai_api_keys = os.getenv("OPENAI_API_KEYS", os.getenv("OPENAI_API_KEY", "")).split(",")
+gpt4_api_keys = os.getenv("GPT4_API_KEYS", os.getenv("OPENAI_API_KEY", "")).split(",")
 chat_models = ["gpt-3.5-turbo"]
 gpt4_chat_models = ["gpt-4-turbo"]
 
+# keep-alive connections to the API, shared by the threads of a process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 32))
+# `on`: print every prompt and response
+LLM_VERBOSE = os.getenv("LLM_VERBOSE", "off") == "on"
+
 
 def random_list(lst):
     return lst[random.randint(0, len(lst) - 1)]
 
 
 def get_openai_api_key():
-    return random_list(openai_api_keys)
+    # the key of the model only names its pool, `PooledSession` picks one per request
+    return openai_api_keys[0].partition("|")[0]
 
 
 def get_openai_chat_model():
@@ -41,30 +53,121 @@ def get_openai_chat_model():
 
 
 def get_gpt4_api_key():
-    return random_list(gpt4_api_keys)
+    return gpt4_api_keys[0].partition("|")[0]
 
 
 def get_gpt4_chat_model():
     return random_list(gpt4_chat_models)
 
 
-def get_openai_chatgpt(verbose=True, **kwargs):
-    return PromptLayerChatOpenAI(
-        verbose=verbose,
-        openai_api_key=get_openai_api_key(),
-        openai_api_base=openai_api_base_default,
-        model_name=get_openai_chat_model(),
-        **kwargs,
+OpenAIKeyPoolProxy = KeyPool("openai", openai_api_keys, RedisClientProxy)
+GPT4KeyPoolProxy = KeyPool("gpt4", gpt4_api_keys, RedisClientProxy)
+
+
+def get_key_pool(data) -> Union[KeyPool, None]:
+    """Pool of the model a request body asks for, None for other requests."""
+    try:
+        model = json.loads(data)["model"]
+    except Exception:
+        return None
+    if model in gpt4_chat_models:
+        return GPT4KeyPoolProxy
+    if model in chat_models:
+        return OpenAIKeyPoolProxy
+    return None
+
+
+class PooledSession(requests.Session):
+    """HTTP session of the process, `openai` closes its sessions every few
+    minutes, which would drop the connections of every thread.
+
+    Chat requests are sent with the least loaded key of their pool, so the
+    retry of a throttled request goes to another key.
+    """
+
+    def __init__(self, pool_size: int):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        pool = get_key_pool(data)
+        if pool is None:
+            return super().request(method, url, headers=headers, data=data, **kwargs)
+        key = pool.acquire()
+        headers = dict(headers or {})
+        if key.key:
+            headers["Authorization"] = f"Bearer {key.key}"
+        # without OPENAI_API_BASE_URL the SDK sends to its own default base
+        base = (openai_api_base_default or openai_sdk.api_base).rstrip("/")
+        if key.base and url.startswith(base):
+            url = key.base.rstrip("/") + url[len(base):]
+        try:
+            response = super().request(method, url, headers=headers, data=data, **kwargs)
+        except Exception:
+            pool.release(key)
+            raise
+        usage = None
+        if response.status_code == 200 and not kwargs.get("stream"):
+            try:
+                usage = response.json().get("usage")
+            except ValueError:
+                pass
+        pool.on_response(key, response.status_code, response.headers, usage)
+        return response
+
+    def close(self):
+        pass
+
+
+openai_sdk.requestssession = PooledSession(LLM_POOL_SIZE)
+
+
+class ChatModelRegistry:
+    """Chat models of the process, one per configuration.
+
+    A model is built and validated once. The settings that change on every
+    call, the PromptLayer tags and the callbacks, go to a shallow copy of it.
+    """
+
+    PER_CALL = ("pl_tags", "callbacks", "callback_manager")
+
+    def __init__(self):
+        self.models = {}
+        self.lock = Lock()
+
+    def get(self, model_name: str, api_key: str, **kwargs) -> PromptLayerChatOpenAI:
+        per_call = {key: kwargs.pop(key) for key in self.PER_CALL if key in kwargs}
+        key = (model_name, api_key, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+        model = self.models.get(key)
+        if model is None:
+            model = PromptLayerChatOpenAI(
+                openai_api_key=api_key,
+                openai_api_base=openai_api_base_default,
+                model_name=model_name,
+                **kwargs,
+            )
+            with self.lock:
+                model = self.models.setdefault(key, model)
+        if "callback_manager" in per_call:
+            # deprecated field, only `callbacks` is read by `generate`
+            per_call["callbacks"] = per_call.pop("callback_manager")
+        return model.copy(update=per_call) if per_call else model
+
+
+ChatModelRegistryProxy = ChatModelRegistry()
+
+
+def get_openai_chatgpt(verbose=LLM_VERBOSE, **kwargs):
+    return ChatModelRegistryProxy.get(
+        get_openai_chat_model(), get_openai_api_key(), verbose=verbose, **kwargs
     )
 
 
-def get_openai_gpt4(verbose=True, **kwargs):
-    return PromptLayerChatOpenAI(
-        verbose=verbose,
-        model_name=get_gpt4_chat_model(),
-        openai_api_key=get_gpt4_api_key(),
-        openai_api_base=openai_api_base_default,
-        **kwargs,
+def get_openai_gpt4(verbose=LLM_VERBOSE, **kwargs):
+    return ChatModelRegistryProxy.get(
+        get_gpt4_chat_model(), get_gpt4_api_key(), verbose=verbose, **kwargs
     )
 
 
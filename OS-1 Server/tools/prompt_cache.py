@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from typing import List
+
+from tools.log import logger
+from tools.prompt_packer import count_tokens
+from tools.redis_client import RedisClientProxy
+
+# seconds the provider keeps a prompt prefix cached without use
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", 5 * 60))
+# shortest prefix the provider caches, and the step of cached lengths
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 1024))
+PROMPT_CACHE_STEP_TOKENS = 128
+
+
+def segment_hashes(segments: List[str]) -> List[str]:
+    """Hash of every prefix of `segments`, a prefix matches only if all of it does."""
+    digest = hashlib.sha1()
+    res = []
+    for segment in segments:
+        digest.update(segment.encode("utf-8"))
+        digest.update(b"\0")
+        res.append(digest.hexdigest())
+    return res
+
+
+class PromptCacheMeter:
+    """Estimate the prompt tokens the provider serves from its prefix cache.
+
+    The segments of every prompt, e.g. the system prompt then each message,
+    are compared with those of the previous prompt of the same user. Matching
+    leading segments are counted as cached, within the rules of the provider
+    cache, the rest as uncached. Totals are kept in `queue_statistic$prompt_cache`.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def record(self, user_id: str, segments: List[str]) -> dict:
+        hashes = segment_hashes(segments)
+        costs = [count_tokens(segment) for segment in segments]
+        key = f"prompt_prefix${user_id}"
+        last = self.redis_client.get(key)
+        last = json.loads(last) if last else []
+        self.redis_client.set(key, json.dumps(hashes), timeout=PROMPT_CACHE_TTL)
+
+        matched = 0
+        for current, previous in zip(hashes, last):
+            if current != previous:
+                break
+            matched += 1
+        prefix = sum(costs[:matched])
+        cached = 0
+        if prefix >= PROMPT_CACHE_MIN_TOKENS:
+            cached = prefix - prefix % PROMPT_CACHE_STEP_TOKENS
+        stats = {
+            "prompt_tokens": sum(costs),
+            "cached_tokens": cached,
+            "matched_segments": matched,
+        }
+
+        self.redis_client.incr_queue_statistic("prompt_cache", "turns")
+        self.redis_client.incr_queue_statistic(
+            "prompt_cache", "prompt_tokens", stats["prompt_tokens"]
+        )
+        self.redis_client.incr_queue_statistic("prompt_cache", "cached_tokens", cached)
+        logger.info(
+            "prompt cache for {}: {}/{} tokens cached, {}/{} segments matched".format(
+                user_id, cached, stats["prompt_tokens"], matched, len(segments)
+            )
+        )
+        return stats
+
+
+PromptCacheMeterProxy = PromptCacheMeter(RedisClientProxy)
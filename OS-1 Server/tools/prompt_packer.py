@@ -0,0 +1,129 @@
+import os
+import re
+from typing import Dict, List, Optional
+
+from tools.log import logger
+
+try:
+    import tiktoken
+
+    ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    ENCODING = None
+
+# tokens the system prompt and the conversation may take together
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 3000))
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    if ENCODING is not None:
+        return len(ENCODING.encode(text))
+    # without tiktoken: about 4 characters per token, 1 token per CJK character
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Section:
+    """A part of the prompt, made of items dropped one by one to fit.
+
+    `priority`: higher is shrunk later. `budget`: most tokens the section may
+    take whatever the room left. `drop`: `head` drops the first items first,
+    e.g. summaries listed oldest first, `tail` the last ones, e.g. memories
+    listed by relevance. `keep`: items that are never dropped. `cut`: whether a
+    long item may be cut instead of dropped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        text: Optional[str],
+        priority: int = 0,
+        budget: Optional[int] = None,
+        drop: str = "tail",
+        keep: int = 0,
+        cut: bool = True,
+        items: Optional[List[str]] = None,
+    ):
+        self.name = name
+        if items is None:
+            items = [line for line in (text or "").split("\n") if line.strip()]
+        self.items = list(items)
+        self.priority = priority
+        self.budget = budget
+        self.drop = drop
+        self.keep = keep
+        self.cut = cut
+        self.costs = [count_tokens(item) for item in self.items]
+        self.dropped = 0
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.costs)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.items)
+
+    def shrink(self, tokens: int) -> int:
+        """Free at least `tokens` if possible, return the tokens freed."""
+        index = 0 if self.drop == "head" else -1
+        freed = 0
+        while freed < tokens and len(self.items) > self.keep:
+            if self.cut and self.costs[index] > 2 * (tokens - freed):
+                # cut a long item instead of losing all of it
+                return freed + self.truncate(index, tokens - freed)
+            self.items.pop(index)
+            self.dropped += 1
+            freed += self.costs.pop(index)
+        return freed
+
+    def truncate(self, index: int, tokens: int) -> int:
+        item, cost = self.items[index], self.costs[index]
+        length = len(item) * (cost - tokens) // cost
+        # the side that is dropped first goes first
+        item = item[len(item) - length :] if self.drop == "head" else item[:length]
+        self.items[index] = item
+        self.costs[index] = count_tokens(item)
+        return cost - self.costs[index]
+
+
+class PromptPacker:
+    """Fit the sections of a prompt in a token budget.
+
+    Every section is first cut to its own budget, then sections are shrunk
+    from the lowest priority up until the total fits. Tokens spent outside the
+    sections, e.g. the template and the user prompt, are passed as `fixed`.
+    """
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+
+    def pack(self, sections: List[Section], fixed: int = 0, name: str = "prompt"):
+        before = {section.name: section.tokens for section in sections}
+        for section in sections:
+            if section.budget is not None and section.tokens > section.budget:
+                section.shrink(section.tokens - section.budget)
+
+        excess = fixed + sum(section.tokens for section in sections) - self.budget
+        for section in sorted(sections, key=lambda s: s.priority):
+            if excess <= 0:
+                break
+            excess -= section.shrink(excess)
+
+        self.log(name, sections, before, fixed)
+        return {section.name: section for section in sections}
+
+    def log(self, name: str, sections: List[Section], before: Dict[str, int], fixed: int):
+        total = fixed + sum(section.tokens for section in sections)
+        breakdown = ", ".join(
+            f"{s.name}: {s.tokens}/{before[s.name]}"
+            + (f" (-{s.dropped} items)" if s.dropped else "")
+            for s in sections
+        )
+        logger.info(
+            f"{name} tokens: {total}/{self.budget}, fixed: {fixed}, {breakdown}"
+        )
@@ -0,0 +1,120 @@
+import os
+from typing import Dict, List, Optional
+
+from bson import json_util
+
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+
+# seconds a section lives without writes, bounds the staleness of writes that
+# bypass the `save_*` methods
+SNAPSHOT_TTL = int(os.getenv("PROMPT_SNAPSHOT_TTL", 6 * 60 * 60))
+# documents kept per section, enough to answer the queries of `generate_prompt`
+SNAPSHOT_SIZES = {
+    "conversation": 32,
+    "context": 8,
+    "history": 4,
+    "policy": 4,
+    "query": 4,
+}
+MEMORY_SNAPSHOT_SIZE = 20
+# bottom (tail) element of every seeded section, so that an empty section
+# still exists in Redis; appends push at the head and trim from the tail, so
+# it is trimmed away once the section holds more than `size` documents
+SENTINEL = "null"
+
+# KEYS: section, dirty flag; ARGV: document, size, ttl
+APPEND_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('LPUSH', KEYS[1], ARGV[1])
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]))
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+else
+    -- a section being loaded from Mongo may have missed this document
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[3])
+end
+"""
+
+# KEYS: section, dirty flag; ARGV: ttl, documents newest first, sentinel
+SEED_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def memory_section(memory_type: int) -> str:
+    return f"memory${memory_type}"
+
+
+def section_size(section: str) -> int:
+    if section.startswith("memory$"):
+        return MEMORY_SNAPSHOT_SIZE
+    return SNAPSHOT_SIZES[section]
+
+
+def snapshot_keys(user_id: str, section: str) -> list:
+    key = f"prompt_snapshot${user_id}${section}"
+    return [key, f"{key}$dirty"]
+
+
+class PromptSnapshotStore:
+    """Latest documents read by `generate_prompt`, per user and section.
+
+    Writers push every saved document, readers load all sections in one round
+    trip. A section only exists once it has been loaded from Mongo, so
+    documents written before are never missing from it.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.append_script = redis_client.register_script(APPEND_LUA)
+        self.seed_script = redis_client.register_script(SEED_LUA)
+
+    def append(self, user_id: str, section: str, document: dict):
+        if user_id is None:
+            return
+        try:
+            self.append_script(
+                keys=snapshot_keys(user_id, section),
+                args=[json_util.dumps(document), section_size(section), SNAPSHOT_TTL],
+            )
+        except Exception as e:
+            # Mongo stays the source of truth, the section expires in time
+            logger.error(f"prompt snapshot append {user_id} {section} error: {e}")
+
+    def load(self, user_id: str, sections: List[str]) -> Dict[str, Optional[list]]:
+        """Documents of each section newest first, `None` if not materialized."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for section in sections:
+            pipe.lrange(snapshot_keys(user_id, section)[0], 0, -1)
+        res = {}
+        for section, items in zip(sections, pipe.execute()):
+            if len(items) == 0:
+                res[section] = None
+                continue
+            res[section] = [
+                json_util.loads(item) for item in items if item.decode() != SENTINEL
+            ]
+        return res
+
+    def begin_seed(self, user_id: str, section: str):
+        """Call before reading Mongo, writes from then on cancel the seed."""
+        self.redis_client.delete(snapshot_keys(user_id, section)[1])
+
+    def seed(self, user_id: str, section: str, documents: list) -> bool:
+        return bool(
+            self.seed_script(
+                keys=snapshot_keys(user_id, section),
+                args=[SNAPSHOT_TTL]
+                + [json_util.dumps(document) for document in documents]
+                + [SENTINEL],
+            )
+        )
+
+
+PromptSnapshotStoreProxy = PromptSnapshotStore(RedisClientProxy.get_client())
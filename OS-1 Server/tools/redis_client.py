@@ -1,6 +1,107 @@
+import hashlib
+import itertools
+import json
+import os
+import socket
+import threading
+import time
 from enum import Enum
 
 import redis
+import redis.asyncio
+
+from tools.fair_queue import FAIR_WAKE_MAX, PUSH_FAIR_LUA, FairQueue, fair_queue_keys
+from tools.log import logger
+
+# `list` (default) or `stream`, see `RedisStreamClient`
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "list")
+REDIS_STREAM_MAXLEN = int(os.getenv("REDIS_STREAM_MAXLEN", 10000))
+REDIS_STREAM_CLAIM_IDLE = int(os.getenv("REDIS_STREAM_CLAIM_IDLE", 60000))
+# deliveries of an entry before it is moved to the dead letter stream `<key>$dead`
+REDIS_STREAM_MAX_DELIVERIES = int(os.getenv("REDIS_STREAM_MAX_DELIVERIES", 3))
+# ms a frame may wait for an image worker, older ones are dropped unprocessed
+IMAGE_DEADLINE = int(os.getenv("IMAGE_DEADLINE", 30 * 1000))
+# seconds raw media bytes stay in Redis after upload, at least as long as a
+# frame may wait in the queue so that no frame is processed without its bytes
+MEDIA_TTL = max(
+    int(os.getenv("REDIS_MEDIA_TTL", 120)), IMAGE_DEADLINE // 1000 + 60
+)
+# `fifo` (default): every frame in arrival order; `latest`: one pending frame
+# per user; `fair`: every frame, users served round robin
+IMAGE_QUEUE = os.getenv("IMAGE_QUEUE", "fifo")
+# `fifo` (default): arrival order; `fair`: users served round robin
+TEXT_QUEUE = os.getenv("TEXT_QUEUE", "fifo")
+# latest gaze samples kept per user for fixation detection
+GAZE_WINDOW = int(os.getenv("GAZE_WINDOW", 200))
+GAZE_TTL = int(os.getenv("GAZE_TTL", 60))
+LATEST_IMAGE_QUEUE = "input_image_latest"
+
+
+def queue_mode(name: str, mode: str) -> str:
+    """`mode` of a queue, `fifo` when it would bypass the stream transport."""
+    if REDIS_TRANSPORT == "stream" and mode != "fifo":
+        # `latest` and `fair` keep their own lists outside the consumer group,
+        # their entries could neither be acknowledged nor reclaimed
+        logger.error(
+            f"{name}={mode} does not work with REDIS_TRANSPORT=stream, "
+            f"falling back to {name}=fifo"
+        )
+        return "fifo"
+    return mode
+
+
+IMAGE_QUEUE = queue_mode("IMAGE_QUEUE", IMAGE_QUEUE)
+TEXT_QUEUE = queue_mode("TEXT_QUEUE", TEXT_QUEUE)
+
+# KEYS: frame of the user, pending users, queue of users, statistics
+# ARGV: uid, frame
+PUSH_LATEST_IMAGE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[4], 'coalesced', 1)
+end
+redis.call('SET', KEYS[1], ARGV[2])
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+"""
+
+# KEYS: frame of the user, pending users; ARGV: uid
+POP_LATEST_IMAGE_LUA = """
+local frame = redis.call('GET', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+return frame
+"""
+
+
+def latest_image_keys(uid: str) -> list:
+    return [
+        f"{LATEST_IMAGE_QUEUE}${uid}",
+        f"{LATEST_IMAGE_QUEUE}$pending",
+        LATEST_IMAGE_QUEUE,
+        "queue_statistic$input_image",
+    ]
+
+
+def response_channel(uid: str) -> str:
+    """Pub/sub channel notified whenever a response is queued for `uid`."""
+    return f"response${uid}"
+
+
+def media_key(data: bytes) -> str:
+    """Content key of raw media bytes, identical uploads share one key."""
+    return f"media${hashlib.sha1(data).hexdigest()}"
+
+
+def gaze_key(uid: str) -> str:
+    return f"gaze${uid}"
+
+
+def dump_gazes(gazes) -> list:
+    return [
+        json.dumps([gaze["timestamp"], gaze["norm_pos_x"], gaze["norm_pos_y"]])
+        for gaze in gazes
+    ]
 
 
 class UserStatus(Enum):
@@ -13,6 +114,16 @@ class UserStatus(Enum):
 class RedisClient:
     def __init__(self, host="localhost", port=6379, db=2):
         self.redis_client = redis.StrictRedis(host=host, port=port, db=db)
+        self.push_latest_image = self.redis_client.register_script(
+            PUSH_LATEST_IMAGE_LUA
+        )
+        self.pop_latest_image = self.redis_client.register_script(
+            POP_LATEST_IMAGE_LUA
+        )
+        self.fair_queues = {
+            "input_text": FairQueue(self.redis_client, "input_text"),
+            "input_image": FairQueue(self.redis_client, "input_image"),
+        }
 
     def get_client(self):
         return self.redis_client
@@ -20,9 +131,34 @@ class RedisClient:
     def rpush(self, key, value):
         self.redis_client.rpush(key, value)
 
+    def lpush(self, key, value):
+        self.redis_client.lpush(key, value)
+
     def lpop(self, key):
         return self.redis_client.lpop(key)
 
+    def blpop(self, key, timeout=1):
+        """Block up to `timeout` seconds, return the value or `None`."""
+        res = self.redis_client.blpop(key, timeout=timeout)
+        if res is None:
+            return None
+        return res[1]
+
+    def push(self, key, value):
+        self.rpush(key, value)
+
+    def pop(self, key, timeout=None):
+        if timeout is None:
+            return self.lpop(key)
+        return self.blpop(key, timeout=timeout)
+
+    def ack(self, key, entry_id=None):
+        """Items of a list are gone once popped, nothing to acknowledge."""
+        pass
+
+    def last_entry_id(self, key):
+        return None
+
     def sadd(self, key, value):
         self.redis_client.sadd(key, value)
 
@@ -43,17 +179,76 @@ class RedisClient:
     def get(self, key):
         return self.redis_client.get(key)
 
+    def set_media(self, data: bytes, timeout=MEDIA_TTL) -> str:
+        key = media_key(data)
+        self.redis_client.set(key, data, ex=timeout)
+        return key
+
+    def get_media(self, key: str, queue: str = None):
+        """Raw bytes of `key`, `None` counted as `media_expired` of `queue` if gone."""
+        data = self.get(key)
+        if data is None and queue is not None:
+            logger.warning(f"media {key} of {queue} expired before it was processed")
+            self.incr_queue_statistic(queue, "media_expired")
+        return data
+
+    def push_gazes(self, uid, gazes):
+        if len(gazes) == 0:
+            return
+        key = gaze_key(uid)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(key, *dump_gazes(gazes))
+        pipe.ltrim(key, -GAZE_WINDOW, -1)
+        pipe.expire(key, GAZE_TTL)
+        pipe.execute()
+
+    def get_gazes(self, uid) -> list:
+        """Gaze samples of the latest heartbeats of `uid`, oldest first."""
+        return [
+            dict(zip(("timestamp", "norm_pos_x", "norm_pos_y"), json.loads(item)))
+            for item in self.redis_client.lrange(gaze_key(uid), 0, -1)
+        ]
+
     def push_data(self, uid, data):
         self.rpush(f"data_{uid}", data)
 
     def pop_data(self, uid):
         return self.lpop(f"data_{uid}")
 
-    def push_image_data(self, data):
-        self.rpush("input_image", data)
-
-    def pop_image_data(self):
-        return self.lpop("input_image")
+    def push_image_data(self, data, uid=None):
+        """With `IMAGE_QUEUE=latest` a new frame replaces the pending one of `uid`."""
+        if IMAGE_QUEUE == "fifo":
+            return self.push("input_image", data)
+        uid = uid or json.loads(data)["user_id"]
+        if IMAGE_QUEUE == "fair":
+            return self.fair_queues["input_image"].push(uid, data)
+        self.push_latest_image(keys=latest_image_keys(uid), args=[uid, data])
+
+    def pop_image_data(self, timeout=None):
+        if IMAGE_QUEUE == "fifo":
+            return self.pop("input_image", timeout=timeout)
+        if IMAGE_QUEUE == "fair":
+            return self.fair_queues["input_image"].pop(timeout=timeout)
+        uid = self.pop(LATEST_IMAGE_QUEUE, timeout=timeout)
+        if uid is None:
+            return None
+        return self.pop_latest_image(
+            keys=latest_image_keys(uid.decode("utf-8"))[:2], args=[uid]
+        )
+
+    def ack_image_data(self, entry_id=None):
+        self.ack("input_image", entry_id)
+
+    def get_image_queue_depth(self) -> int:
+        """Frames waiting for an image worker."""
+        if IMAGE_QUEUE == "latest":
+            return self.redis_client.llen(LATEST_IMAGE_QUEUE)
+        if IMAGE_QUEUE == "fair":
+            return self.fair_queues["input_image"].length()
+        return self.queue_length("input_image")
+
+    def queue_length(self, key) -> int:
+        return self.redis_client.llen(key)
 
     def push_audio_data(self, uid, data):
         self.rpush(f"input_audio_{uid}", data)
@@ -61,26 +256,45 @@ class RedisClient:
     def insert_audio_data(self, uid, data):
         self.lpush(f"input_audio_{uid}", data)
 
-    def pop_audio_data(self, uid):
-        return self.lpop(f"input_audio_{uid}")
+    def pop_audio_data(self, uid, timeout=None):
+        return self.pop(f"input_audio_{uid}", timeout=timeout)
+
+    def push_text_data(self, data, uid=None):
+        if TEXT_QUEUE == "fifo":
+            return self.push("input_text", data)
+        uid = uid or json.loads(data)["user_id"]
+        self.fair_queues["input_text"].push(uid, data)
 
-    def push_text_data(self, data):
-        self.rpush("input_text", data)
+    def pop_text_data(self, timeout=None):
+        if TEXT_QUEUE == "fifo":
+            return self.pop("input_text", timeout=timeout)
+        return self.fair_queues["input_text"].pop(timeout=timeout)
 
-    def pop_text_data(self):
-        return self.lpop("input_text")
+    def set_user_weight(self, queue: str, uid: str, weight: float):
+        """Share of `queue` given to `uid` relative to other users (default 1)."""
+        self.fair_queues[queue].set_weight(uid, weight)
+
+    def ack_text_data(self, entry_id=None):
+        self.ack("input_text", entry_id)
 
     def push_msg_text(self, data):
-        self.rpush("response_text", data)
+        self.push("response_text", data)
+
+    def pop_msg_text(self, timeout=None):
+        return self.pop("response_text", timeout=timeout)
 
-    def pop_msg_text(self):
-        return self.lpop("response_text")
+    def ack_msg_text(self, entry_id=None):
+        self.ack("response_text", entry_id)
 
     def push_msg(self, uid, data, timeout=900):
         key = f"response_{uid}"
-        self.rpush(key, data)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(key, data)
         if timeout:
-            self.redis_client.expire(key, timeout)
+            pipe.expire(key, timeout)
+        # wake up the connection of `uid` waiting in `data_server.py`
+        pipe.publish(response_channel(uid), 1)
+        pipe.execute()
 
     def pop_msg(self, uid):
         return self.lpop(f"response_{uid}")
@@ -133,6 +347,81 @@ class RedisClient:
             res[key.split("$")[-1]] = value.decode("utf-8")
         return res
 
+    def incr_queue_statistic(self, queue: str, key: str, amount: int = 1):
+        self.redis_client.hincrby(f"queue_statistic${queue}", key, amount)
+
+    def get_queue_statistics(self, queue: str) -> dict:
+        res = self.redis_client.hgetall(f"queue_statistic${queue}")
+        return {k.decode("utf-8"): int(v) for k, v in res.items()}
+
+    def set_worker_statistic(self, worker_id: str, value: str, timeout=None):
+        """One hash for all workers, read in a single round trip without `KEYS`.
+
+        Fields cannot expire, so each one has its deadline in `$expire_at`.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset("worker_statistic", worker_id, value)
+        if timeout:
+            pipe.hset("worker_statistic$expire_at", worker_id, int(time.time() + timeout))
+        pipe.execute()
+
+    def get_worker_statistics(self) -> dict:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall("worker_statistic")
+        pipe.hgetall("worker_statistic$expire_at")
+        values, deadlines = pipe.execute()
+        now = time.time()
+        res = {}
+        expired = []
+        for worker_id, value in values.items():
+            deadline = deadlines.get(worker_id)
+            if deadline is not None and int(deadline) < now:
+                # a dead worker stopped reporting
+                expired.append(worker_id)
+                continue
+            res[worker_id.decode("utf-8")] = value.decode("utf-8")
+        if expired:
+            pipe.hdel("worker_statistic", *expired)
+            pipe.hdel("worker_statistic$expire_at", *expired)
+            pipe.execute()
+        return res
+
+    def push_agent_result(self, user_id: str, turn: int, kind: str, value=None, timeout=60):
+        key = f"agent_result${user_id}${turn}${kind}"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(key, json.dumps({"value": value}))
+        pipe.expire(key, timeout)
+        pipe.execute()
+
+    def wait_agent_result(self, user_id: str, turn: int, kind: str, timeout: float):
+        """Block up to `timeout` seconds for the result, `None` if missing or empty."""
+        key = f"agent_result${user_id}${turn}${kind}"
+        if timeout > 0:
+            res = self.redis_client.blpop(key, timeout=timeout)
+            res = res[1] if res else None
+        else:
+            res = self.redis_client.lpop(key)
+        return json.loads(res)["value"] if res else None
+
+    def push_hedge_sample(self, value: str, maxlen: int = 1000):
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush("response_hedge$samples", value)
+        pipe.ltrim("response_hedge$samples", -maxlen, -1)
+        pipe.execute()
+
+    def get_hedge_samples(self) -> list:
+        return [json.loads(v) for v in self.redis_client.lrange("response_hedge$samples", 0, -1)]
+
+    def set_speculation(self, user_id: str, value: str, timeout=None):
+        self.set(f"speculation${user_id}", value, timeout=timeout)
+
+    def pop_speculation(self, user_id: str):
+        """A speculation serves one turn only."""
+        pipe = self.redis_client.pipeline()
+        pipe.get(f"speculation${user_id}")
+        pipe.delete(f"speculation${user_id}")
+        return pipe.execute()[0]
+
     def set_reset_token(self, user_id: str, token: str, timeout=300):
         self.set(f"reset_token${user_id}", token, timeout=timeout)
 
@@ -144,7 +433,304 @@ class RedisClient:
         self.redis_client.delete(f"reset_token${user_id}")
 
 
-RedisClientProxy = RedisClient()
+class RedisStreamClient(RedisClient):
+    """Carry `input_text`, `input_image` and `response_text` over Redis Streams.
+
+    Each stream is read by one consumer group, so any number of worker
+    processes on any machine share the load. An entry stays pending until it
+    is acknowledged, and entries left pending by a crashed consumer are
+    reclaimed by the others after `claim_idle` ms. The entry a thread is
+    handling is claimed again by its owner every `claim_idle / 3` ms, so a
+    long turn is never reclaimed and run twice while it is still alive.
+    """
+
+    STREAM_GROUPS = {
+        "input_text": "chatbot",
+        "input_image": "image",
+        "response_text": "msg",
+    }
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=2,
+        maxlen=REDIS_STREAM_MAXLEN,
+        claim_idle=REDIS_STREAM_CLAIM_IDLE,
+        claim_interval=5,
+        max_deliveries=REDIS_STREAM_MAX_DELIVERIES,
+    ):
+        super().__init__(host=host, port=port, db=db)
+        self.maxlen = maxlen
+        self.claim_idle = claim_idle
+        self.claim_interval = claim_interval
+        self.max_deliveries = max_deliveries
+        self.groups = set()
+        self.last_claim = {}
+        self.local = threading.local()
+        self.thread_index = itertools.count()
+        # (key, consumer) -> entry being handled, kept pending by `keep_alive`
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.keeper = None
+
+    def consumer_name(self):
+        # thread idents are reused and unbounded, an index keeps names few
+        if not hasattr(self.local, "index"):
+            self.local.index = next(self.thread_index)
+        return f"{socket.gethostname()}-{os.getpid()}-{self.local.index}"
+
+    def ensure_group(self, key):
+        if key in self.groups:
+            return
+        group = self.STREAM_GROUPS[key]
+        try:
+            self.redis_client.xgroup_create(key, group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.delete_stale_consumers(key)
+        self.groups.add(key)
+
+    def delete_stale_consumers(self, key):
+        """Consumers of dead processes, once their entries were reclaimed.
+
+        A live consumer reads at least every few seconds, one idle for
+        `claim_idle` without pending entries is gone. Deleting a consumer
+        drops its pending entries, so one that still has some is kept until
+        they are reclaimed.
+        """
+        group = self.STREAM_GROUPS[key]
+        for consumer in self.redis_client.xinfo_consumers(key, group):
+            if consumer["pending"] > 0 or consumer["idle"] < self.claim_idle:
+                continue
+            self.redis_client.xgroup_delconsumer(key, group, consumer["name"])
+            logger.info(f"deleted stale consumer {consumer['name'].decode('utf-8')} of {key}")
+
+    def keep_alive(self):
+        """Reset the idle time of the entries being handled, as long as they are ours."""
+        while True:
+            time.sleep(self.claim_idle / 3000)
+            with self.lock:
+                in_flight = list(self.in_flight.items())
+            for (key, consumer), entry_id in in_flight:
+                group = self.STREAM_GROUPS[key]
+                try:
+                    pending = self.redis_client.xpending_range(
+                        key, group, min=entry_id, max=entry_id, count=1, consumername=consumer
+                    )
+                    if len(pending) == 0:
+                        # acknowledged or reclaimed meanwhile
+                        continue
+                    # JUSTID leaves the delivery count alone
+                    self.redis_client.xclaim(
+                        key, group, consumer, min_idle_time=0, message_ids=[entry_id], justid=True
+                    )
+                except Exception as e:
+                    logger.error(f"keep alive of {key} entry {entry_id} failed: {e}")
+
+    def track(self, key, entry_id):
+        """`entry_id` is now handled by the current thread, its previous entry is not."""
+        with self.lock:
+            if entry_id is None:
+                self.in_flight.pop((key, self.consumer_name()), None)
+            else:
+                self.in_flight[(key, self.consumer_name())] = entry_id
+            if self.keeper is None:
+                self.keeper = threading.Thread(target=self.keep_alive, daemon=True)
+                self.keeper.start()
+
+    def push(self, key, value):
+        if key not in self.STREAM_GROUPS:
+            return super().push(key, value)
+        self.redis_client.xadd(
+            key, {"data": value}, maxlen=self.maxlen, approximate=True
+        )
+
+    def claim_pending(self, key):
+        now = time.time()
+        if now - self.last_claim.get(key, 0) < self.claim_interval:
+            return None
+        group = self.STREAM_GROUPS[key]
+        res = self.redis_client.xautoclaim(
+            key,
+            group,
+            self.consumer_name(),
+            min_idle_time=self.claim_idle,
+            start_id="0-0",
+            count=1,
+        )
+        entries = [entry for entry in res[1] if entry[0] is not None]
+        if len(entries) == 0:
+            self.last_claim[key] = now
+            return None
+
+        entry_id, fields = entries[0]
+        pending = self.redis_client.xpending_range(
+            key, group, min=entry_id, max=entry_id, count=1
+        )
+        deliveries = pending[0]["times_delivered"] if pending else 0
+        if fields is None:
+            # trimmed from the stream while pending, nothing left to handle
+            self.redis_client.xack(key, group, entry_id)
+            return None
+        if deliveries > self.max_deliveries:
+            logger.error(
+                f"dead letter {key} entry {entry_id} after {deliveries} deliveries"
+            )
+            pipe = self.redis_client.pipeline()
+            pipe.xadd(
+                f"{key}$dead",
+                {**fields, b"entry_id": entry_id, b"deliveries": deliveries},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+            pipe.xack(key, group, entry_id)
+            pipe.execute()
+            self.redis_client.hincrby(f"queue_statistic${key}", "dead_letter", 1)
+            return None
+        logger.info(f"reclaimed {key} entry {entry_id}, deliveries: {deliveries}")
+        return entries[0]
+
+    def pop(self, key, timeout=None):
+        if key not in self.STREAM_GROUPS:
+            return super().pop(key, timeout=timeout)
+        self.ensure_group(key)
+
+        # an entry left unacknowledged by a failure is not kept alive anymore
+        self.track(key, None)
+        entry = self.claim_pending(key)
+        if entry is None:
+            res = self.redis_client.xreadgroup(
+                self.STREAM_GROUPS[key],
+                self.consumer_name(),
+                {key: ">"},
+                count=1,
+                # `None` returns at once like `lpop`, 0 would block forever
+                block=None if timeout is None else max(int(timeout * 1000), 1),
+            )
+            if not res or len(res[0][1]) == 0:
+                return None
+            entry = res[0][1][0]
+
+        entry_id, fields = entry
+        setattr(self.local, key, entry_id)
+        self.track(key, entry_id)
+        return fields[b"data"]
+
+    def ack(self, key, entry_id=None):
+        if key not in self.STREAM_GROUPS:
+            return
+        entry_id = entry_id or self.last_entry_id(key)
+        if entry_id is None:
+            return
+        self.redis_client.xack(key, self.STREAM_GROUPS[key], entry_id)
+        with self.lock:
+            for owner in [o for o, e in self.in_flight.items() if o[0] == key and e == entry_id]:
+                del self.in_flight[owner]
+        if getattr(self.local, key, None) == entry_id:
+            setattr(self.local, key, None)
+
+    def last_entry_id(self, key):
+        """Id of the latest entry popped by the current thread."""
+        return getattr(self.local, key, None)
+
+    def queue_length(self, key) -> int:
+        if key not in self.STREAM_GROUPS:
+            return super().queue_length(key)
+        # entries not delivered yet plus delivered but not acknowledged
+        group = self.redis_client.xinfo_groups(key)
+        group = [g for g in group if g["name"].decode("utf-8") == self.STREAM_GROUPS[key]]
+        if len(group) == 0:
+            return self.redis_client.xlen(key)
+        return (group[0].get("lag") or 0) + group[0]["pending"]
+
+
+class AsyncRedisClient:
+    """asyncio client for the ingest path of `data_server.py`.
+
+    All requests of a uvicorn worker share one connection pool, and the
+    writes of a heartbeat are sent in a single pipelined round trip.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=2, max_connections=64):
+        # wait for a free connection instead of failing under bursts
+        self.pool = redis.asyncio.BlockingConnectionPool(
+            host=host, port=port, db=db, max_connections=max_connections
+        )
+        self.redis_client = redis.asyncio.StrictRedis(connection_pool=self.pool)
+        self.push_latest_image = self.redis_client.register_script(
+            PUSH_LATEST_IMAGE_LUA
+        )
+        self.push_fair = self.redis_client.register_script(PUSH_FAIR_LUA)
+
+    def get_client(self):
+        return self.redis_client
+
+    @staticmethod
+    def push(pipe, key, value):
+        if REDIS_TRANSPORT == "stream" and key in RedisStreamClient.STREAM_GROUPS:
+            pipe.xadd(key, {"data": value}, maxlen=REDIS_STREAM_MAXLEN, approximate=True)
+        else:
+            pipe.rpush(key, value)
+
+    async def push_heartbeat(
+        self, uid, image_data=None, audio_data=None, media=None, gazes=None
+    ):
+        """`media` maps the content keys referenced by the payloads to raw bytes."""
+        await self.push_heartbeats(
+            uid,
+            [
+                {
+                    "image_data": image_data,
+                    "audio_data": audio_data,
+                    "media": media,
+                    "gazes": gazes,
+                }
+            ],
+        )
+
+    async def push_heartbeats(self, uid, heartbeats: list):
+        """Writes of several heartbeats of `uid`, oldest first, in one round trip."""
+        gazes = [gaze for heartbeat in heartbeats for gaze in heartbeat["gazes"] or []]
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.sadd("users", uid)
+            if gazes:
+                pipe.rpush(gaze_key(uid), *dump_gazes(gazes))
+                pipe.ltrim(gaze_key(uid), -GAZE_WINDOW, -1)
+                pipe.expire(gaze_key(uid), GAZE_TTL)
+            for heartbeat in heartbeats:
+                for key, value in (heartbeat["media"] or {}).items():
+                    pipe.set(key, value, ex=MEDIA_TTL)
+                image_data = heartbeat["image_data"]
+                if image_data is not None and IMAGE_QUEUE == "latest":
+                    await self.push_latest_image(
+                        keys=latest_image_keys(uid), args=[uid, image_data], client=pipe
+                    )
+                elif image_data is not None and IMAGE_QUEUE == "fair":
+                    await self.push_fair(
+                        keys=fair_queue_keys("input_image", uid),
+                        args=[uid, image_data, FAIR_WAKE_MAX],
+                        client=pipe,
+                    )
+                elif image_data is not None:
+                    self.push(pipe, "input_image", image_data)
+                if heartbeat["audio_data"] is not None:
+                    pipe.rpush(f"input_audio_{uid}", heartbeat["audio_data"])
+            await pipe.execute()
+
+    async def pop_msg(self, uid):
+        return await self.redis_client.lpop(f"response_{uid}")
+
+
+if REDIS_TRANSPORT == "stream":
+    RedisClientProxy = RedisStreamClient()
+else:
+    RedisClientProxy = RedisClient()
+
+AsyncRedisClientProxy = AsyncRedisClient(
+    max_connections=int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", 64))
+)
 
 if __name__ == "__main__":
     from base.auditory import AuditoryContext
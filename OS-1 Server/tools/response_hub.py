@@ -0,0 +1,99 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Dict, Set
+
+from tools.log import logger
+from tools.redis_client import AsyncRedisClient, response_channel
+
+# seconds a connection sleeps without notification before checking the queue
+WAIT_TIMEOUT = 15
+
+
+class ResponseHub:
+    """Wake up the response connections of one uvicorn worker.
+
+    The hub holds a single pub/sub connection and only subscribes to the
+    channels of users connected to this worker, so a message sent by
+    `MessageSenderWithRedis` wakes exactly the connection waiting for it
+    instead of every connection polling Redis.
+    """
+
+    KEEPALIVE_CHANNEL = response_channel("$hub")
+
+    def __init__(self, redis_client: AsyncRedisClient):
+        self.redis_client = redis_client
+        self.pubsub = None
+        self.listener = None
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    async def start(self):
+        self.pubsub = self.redis_client.get_client().pubsub(
+            ignore_subscribe_messages=True
+        )
+        # keep one subscription so that `get_message` never returns at once
+        await self.pubsub.subscribe(self.KEEPALIVE_CHANNEL)
+        self.listener = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+        if self.pubsub is not None:
+            await self.pubsub.close()
+
+    async def listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+                if message is None:
+                    continue
+                uid = message["channel"].decode("utf-8").split("$", 1)[1]
+                for event in self.waiters.get(uid, ()):
+                    event.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"ResponseHub listen error: {e}")
+                await asyncio.sleep(1)
+
+    @asynccontextmanager
+    async def subscribe(self, uid: str):
+        event = asyncio.Event()
+        if uid not in self.waiters:
+            self.waiters[uid] = set()
+            await self.pubsub.subscribe(response_channel(uid))
+        self.waiters[uid].add(event)
+        try:
+            yield event
+        finally:
+            self.waiters[uid].discard(event)
+            if len(self.waiters[uid]) == 0:
+                del self.waiters[uid]
+                await self.pubsub.unsubscribe(response_channel(uid))
+
+    async def pop(self, uid: str, event: asyncio.Event, timeout: float):
+        """Pop the next response of `uid`, waiting up to `timeout` seconds."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            # clear before popping, a publish after this point is not lost
+            event.clear()
+            res = await self.redis_client.pop_msg(uid)
+            if res:
+                return json.loads(res)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def iter_responses(self, uid: str):
+        async with self.subscribe(uid) as event:
+            while True:
+                res = await self.pop(uid, event, timeout=WAIT_TIMEOUT)
+                if res is not None:
+                    yield res
@@ -0,0 +1,100 @@
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+
+from tools.log import logger
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        deps: Sequence[str] = (),
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.timeout = timeout
+
+
+class StageGraph:
+    """Run dependent stages on threads, each one as soon as its deps are done.
+
+    A stage is called with the results of its deps, in order. A dep that
+    failed or timed out passes `None`, so its dependents fall back instead of
+    being skipped. A timed out stage is abandoned, not interrupted.
+    """
+
+    def __init__(self, name: str = "stage_graph", max_workers: int = 8):
+        self.name = name
+        self.max_workers = max_workers
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, object] = {}
+        # name -> {"status": ok | error | timeout, "cost": ms}
+        self.timings: Dict[str, dict] = {}
+
+    def add(self, name: str, func: Callable, deps: Sequence[str] = (), timeout=None):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"{self.name}: unknown dep {dep} of {name}")
+        self.stages[name] = Stage(name, func, deps=deps, timeout=timeout)
+        return self
+
+    def preset(self, name: str, result=None):
+        """Mark `name` as done with `result`, e.g. computed ahead of time."""
+        self.stages[name] = Stage(name, None)
+        self.finish(self.stages[name], time.time(), "preset", result)
+        return self
+
+    def finish(self, stage: Stage, started: float, status: str, result=None):
+        self.results[stage.name] = result
+        self.timings[stage.name] = {
+            "status": status,
+            "cost": int((time.time() - started) * 1000),
+        }
+
+    def run(self) -> Dict[str, object]:
+        pending: List[Stage] = [s for s in self.stages.values() if s.name not in self.timings]
+        running = {}
+        start = time.time()
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                for stage in [s for s in pending if all(d in self.timings for d in s.deps)]:
+                    pending.remove(stage)
+                    args = [self.results[dep] for dep in stage.deps]
+                    running[pool.submit(stage.func, *args)] = (stage, time.time())
+
+                deadlines = [
+                    started + stage.timeout
+                    for stage, started in running.values()
+                    if stage.timeout is not None
+                ]
+                timeout = max(min(deadlines) - time.time(), 0) if deadlines else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, started = running.pop(future)
+                    try:
+                        self.finish(stage, started, "ok", future.result())
+                    except Exception as e:
+                        logger.error(f"{self.name} stage {stage.name} error: {e}")
+                        self.finish(stage, started, "error")
+
+                now = time.time()
+                for future, (stage, started) in list(running.items()):
+                    if now - started >= (stage.timeout or math.inf):
+                        logger.warning(f"{self.name} stage {stage.name} timed out")
+                        running.pop(future)
+                        self.finish(stage, started, "timeout")
+        finally:
+            # timed out stages keep their thread until they return
+            pool.shutdown(wait=False)
+
+        logger.info(
+            "{}: {:.2f}s, {}".format(self.name, time.time() - start, self.timings)
+        )
+        return self.results
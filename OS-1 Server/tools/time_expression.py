@@ -0,0 +1,205 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from tools.time_fmt import PeriodOfDay, get_past_timestamp
+
+# every day starts at 4am, as in `get_past_timestamp`
+DAY_START_HOUR = 4
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+ZH_NUMBERS = {"一": 1, "两": 2, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10, "半": 0.5}
+EN_NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "few": 3, "couple of": 2, "half an": 0.5}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+ZH_WEEKDAYS = "一二三四五六日"
+
+EN_PERIODS = {
+    "morning": PeriodOfDay.MORNING,
+    "noon": PeriodOfDay.NOON,
+    "afternoon": PeriodOfDay.AFTERNOON,
+    "evening": PeriodOfDay.EVENING,
+    "night": PeriodOfDay.NIGHT,
+}
+ZH_PERIODS = {
+    "早上": PeriodOfDay.MORNING,
+    "上午": PeriodOfDay.MORNING,
+    "中午": PeriodOfDay.NOON,
+    "下午": PeriodOfDay.AFTERNOON,
+    "傍晚": PeriodOfDay.DUSK,
+    "晚上": PeriodOfDay.EVENING,
+    "夜里": PeriodOfDay.NIGHT,
+}
+
+EN_AGO = re.compile(
+    r"\b(\d+|a|an|one|two|three|four|five|six|few|couple of|half an)\s+"
+    r"(minute|min|hour)s?\s+ago\b"
+)
+ZH_AGO = re.compile(
+    r"((?:\d+|[一两二三四五六七八九十]+)个半|\d+|[一两二三四五六七八九十半]+)\s*个?\s*(分钟|小时|钟头)(之|以)?前"
+)
+EN_DAYS_AGO = re.compile(r"\b(\d+|two|three|four|five|six)\s+days\s+ago\b")
+ZH_DAYS_AGO = re.compile(r"(\d+|[两二三四五六七])\s*天(之|以)?前")
+EN_DAY = re.compile(
+    r"\b(this|last|yesterday|today|tonight)\s*(morning|noon|afternoon|evening|night)?\b"
+)
+ZH_DAY = re.compile(r"(今天|今早|今晚|昨天|昨晚|前天)(早上|上午|中午|下午|傍晚|晚上|夜里)?")
+EN_WEEKDAY = re.compile(r"\b(last\s+|on\s+)?(" + "|".join(WEEKDAYS) + r")\b")
+ZH_WEEKDAY = re.compile(r"(上)?(周|星期|礼拜)([一二三四五六日天])")
+EN_WEEK = re.compile(r"\b(this|last)\s+week\b")
+ZH_WEEK = re.compile(r"(这|本|上)(周|星期|个星期|礼拜)(?![一二三四五六日天])")
+EN_RECENT = re.compile(r"\b(just now|a moment ago|a while ago|earlier today)\b")
+ZH_RECENT = re.compile(r"刚才|刚刚")
+
+
+@dataclass
+class TimeSpan:
+    start: int
+    end: int
+    # what the span was parsed from, for the logs
+    expression: str
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+
+def to_number(value: str) -> float:
+    if value.endswith("个半"):
+        # 一个半, 两个半: one and a half, two and a half
+        return to_number(value[:-2]) + 0.5
+    if value.isdigit():
+        return int(value)
+    if value in EN_NUMBERS:
+        return EN_NUMBERS[value]
+    if "十" in value:
+        # 十, 十五, 二十, 二十五
+        tens, _, units = value.partition("十")
+        return ZH_NUMBERS.get(tens, 1) * 10 + ZH_NUMBERS.get(units, 0)
+    return ZH_NUMBERS.get(value, 1)
+
+
+def day_start(now: int, days: int = 0) -> int:
+    return get_past_timestamp(days=days, day_start_hour=DAY_START_HOUR, current_time=now)
+
+
+def period_span(now: int, days: int, period: PeriodOfDay) -> tuple:
+    """Hours of `period`, on the day `days` before the one of `now`."""
+    date = datetime.fromtimestamp(day_start(now, days) / 1000).date()
+    start_hour, end_hour = period.value
+    if end_hour <= start_hour:
+        # the night runs past midnight
+        end_hour += 24
+    start = datetime(date.year, date.month, date.day) + timedelta(hours=start_hour)
+    end = datetime(date.year, date.month, date.day) + timedelta(hours=end_hour)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def ago_span(now: int, value: float, unit: int) -> tuple:
+    # "an hour ago" covers half an hour around it, "5 minutes ago" 10 minutes
+    ago = int(value * unit)
+    margin = max(ago // 2, 10 * MINUTE)
+    return now - ago - margin, now - ago + margin
+
+
+def weekday_span(now: int, weekday: int, last_week: bool) -> tuple:
+    """Whole day of the latest past `weekday` (0 is Monday).
+
+    With `last_week` the day is taken in the calendar week before this one,
+    as "上周五" means, even when the latest Friday was yesterday.
+    """
+    today = datetime.fromtimestamp(day_start(now) / 1000)
+    days = (today.weekday() - weekday) % 7 or 7
+    if last_week and days <= today.weekday():
+        days += 7
+    return day_start(now, days), day_start(now, days - 1)
+
+
+def week_span(now: int, last_week: bool) -> tuple:
+    today = datetime.fromtimestamp(day_start(now) / 1000)
+    start = day_start(now, today.weekday())
+    if last_week:
+        return start - 7 * DAY, start
+    return start, now
+
+
+def parse_time_expression(text: Optional[str], now: int) -> Optional[TimeSpan]:
+    """Time span a question refers to, e.g. "this morning" or "一个小时前"."""
+    if not text:
+        return None
+    lower = text.lower()
+
+    match = EN_AGO.search(lower) or ZH_AGO.search(text)
+    if match:
+        unit = MINUTE if match.group(2) in ("minute", "min", "分钟") else HOUR
+        start, end = ago_span(now, to_number(match.group(1)), unit)
+        return TimeSpan(start, min(end, now), match.group(0))
+
+    match = EN_RECENT.search(lower) or ZH_RECENT.search(text)
+    if match:
+        span = 3 * HOUR if match.group(0) == "earlier today" else 30 * MINUTE
+        return TimeSpan(max(now - span, day_start(now)), now, match.group(0))
+
+    match = EN_DAYS_AGO.search(lower) or ZH_DAYS_AGO.search(text)
+    if match:
+        days = int(to_number(match.group(1)))
+        return TimeSpan(day_start(now, days), day_start(now, days - 1), match.group(0))
+
+    # "this" and "last" alone are no time, e.g. "last time"
+    match = next(
+        (
+            m
+            for m in EN_DAY.finditer(lower)
+            if m.group(1) not in ("this", "last") or m.group(2) is not None
+        ),
+        None,
+    )
+    if match:
+        word, period = match.group(1), match.group(2)
+        # "last evening" is yesterday evening, as "last night"
+        days = 1 if word in ("yesterday", "last") else 0
+        if word == "tonight":
+            period = "evening"
+        if period is None:
+            start, end = day_start(now, days), day_start(now, days - 1) if days else now
+        else:
+            start, end = period_span(now, days, EN_PERIODS[period])
+        if start >= now:
+            # "tonight" asked in the afternoon, nothing to remember yet
+            return None
+        return TimeSpan(start, min(end, now), match.group(0))
+
+    match = ZH_DAY.search(text)
+    if match:
+        word, period = match.group(1), match.group(2)
+        days = {"今": 0, "昨": 1, "前": 2}[word[0]]
+        if word in ("今早", "今晚", "昨晚"):
+            period = "早上" if word == "今早" else "晚上"
+        if period is None:
+            start, end = day_start(now, days), day_start(now, days - 1) if days else now
+        else:
+            start, end = period_span(now, days, ZH_PERIODS[period])
+        if start >= now:
+            return None
+        return TimeSpan(start, min(end, now), match.group(0))
+
+    match = EN_WEEKDAY.search(lower)
+    if match:
+        # "last friday" asked on a Saturday is yesterday, the latest Friday,
+        # unlike "上周五" it is not tied to the calendar week
+        start, end = weekday_span(now, WEEKDAYS.index(match.group(2)), False)
+        return TimeSpan(start, end, match.group(0))
+
+    match = ZH_WEEKDAY.search(text)
+    if match:
+        weekday = ZH_WEEKDAYS.index(match.group(3)) if match.group(3) != "天" else 6
+        start, end = weekday_span(now, weekday, match.group(1) is not None)
+        return TimeSpan(start, end, match.group(0))
+
+    match = EN_WEEK.search(lower) or ZH_WEEK.search(text)
+    if match:
+        start, end = week_span(now, match.group(1) in ("last", "上"))
+        return TimeSpan(start, end, match.group(0))
+    return None
@@ -0,0 +1,251 @@
+import json
+import os
+import signal
+import threading
+import time
+import traceback
+from abc import ABCMeta, abstractmethod
+from multiprocessing import Process
+from typing import Callable, List, Optional
+
+from tools.log import logger
+from tools.redis_client import RedisClientProxy
+
+# seconds a worker blocks on an empty queue before re-checking the stop flag
+POP_TIMEOUT = int(os.getenv("WORKER_POP_TIMEOUT", 1))
+# seconds between two throughput reports in the logs
+STATS_INTERVAL = int(os.getenv("WORKER_STATS_INTERVAL", 60))
+# seconds between two throughput reports to Redis, read for capture control
+REPORT_INTERVAL = int(os.getenv("WORKER_REPORT_INTERVAL", 5))
+
+
+def get_worker_config(name: str, processes: int = 1, threads: int = 1):
+    """Read `{NAME}_WORKER_PROCESSES` / `{NAME}_WORKER_THREADS` from env."""
+    prefix = name.upper()
+    return (
+        int(os.getenv(f"{prefix}_WORKER_PROCESSES", processes)),
+        int(os.getenv(f"{prefix}_WORKER_THREADS", threads)),
+    )
+
+
+class QueueWorker(metaclass=ABCMeta):
+    @abstractmethod
+    def pull(self, timeout: int) -> Optional[dict]:
+        """Block up to `timeout` seconds for the next item, `None` if idle."""
+        pass
+
+    @abstractmethod
+    def handle(self, data: dict):
+        pass
+
+    def ack(self, data: dict):
+        """Called once `handle` succeeds, so the item is not redelivered.
+
+        A failed item stays pending and is redelivered, up to the delivery
+        cap of the transport.
+        """
+        pass
+
+
+class WorkerStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.processed = 0
+        self.failed = 0
+        self.idle = 0
+        self.busy_time = 0.0
+        # counters at the start of the current report window
+        self.window_start = (self.start_time, 0, 0.0)
+
+    def record(self, cost: float, success: bool = True):
+        with self.lock:
+            if success:
+                self.processed += 1
+            else:
+                self.failed += 1
+            self.busy_time += cost
+
+    def record_idle(self):
+        with self.lock:
+            self.idle += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "idle": self.idle,
+                "throughput": round((self.processed + self.failed) / elapsed, 3),
+                "busy_ratio": round(self.busy_time / elapsed, 3),
+                "updated_at": int(time.time() * 1000),
+            }
+
+    def window(self) -> dict:
+        """Snapshot with the rates of the last window only, so they follow the
+        current health of the worker instead of its average since start."""
+        snapshot = self.snapshot()
+        with self.lock:
+            now = time.time()
+            started, handled, busy_time = self.window_start
+            elapsed = max(now - started, 1e-6)
+            total = self.processed + self.failed
+            # an idle window says nothing of the capacity, the averages stay
+            if self.busy_time > busy_time:
+                snapshot["throughput"] = round((total - handled) / elapsed, 3)
+                snapshot["busy_ratio"] = round((self.busy_time - busy_time) / elapsed, 3)
+            self.window_start = (now, total, self.busy_time)
+        return snapshot
+
+
+class WorkerRuntime:
+    """Run `QueueWorker`s on threads of the current process.
+
+    Every thread gets its own worker from `worker_factory` and blocks on the
+    queue instead of spinning, so an idle runtime costs no CPU.
+    """
+
+    def __init__(
+        self,
+        worker_factory: Callable[[], QueueWorker],
+        name: Optional[str] = None,
+        num_threads: int = 1,
+        pop_timeout: int = POP_TIMEOUT,
+        stats_interval: int = STATS_INTERVAL,
+    ):
+        self.worker_factory = worker_factory
+        self.name = name or getattr(worker_factory, "__name__", "worker")
+        self.num_threads = num_threads
+        self.pop_timeout = pop_timeout
+        self.stats_interval = stats_interval
+        self.stop_event = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.stats: List[WorkerStats] = []
+
+    def start(self):
+        for i in range(self.num_threads):
+            stats = WorkerStats(f"{self.name}-{os.getpid()}-{i}")
+            thread = threading.Thread(
+                target=self.serve, args=(stats,), name=stats.name, daemon=True
+            )
+            self.stats.append(stats)
+            self.threads.append(thread)
+            thread.start()
+        reporter = threading.Thread(target=self.report_stats, daemon=True)
+        reporter.start()
+        logger.info(f"{self.name} started with {self.num_threads} thread(s)")
+        return self
+
+    def create_worker(self, stats: WorkerStats) -> Optional[QueueWorker]:
+        while not self.stop_event.is_set():
+            try:
+                return self.worker_factory()
+            except Exception as e:
+                logger.error(
+                    "{} init error: {}, {}".format(stats.name, e, traceback.format_exc())
+                )
+                self.stop_event.wait(self.pop_timeout)
+        return None
+
+    def serve(self, stats: WorkerStats):
+        worker = self.create_worker(stats)
+        while worker is not None and not self.stop_event.is_set():
+            try:
+                data = worker.pull(timeout=self.pop_timeout)
+            except Exception as e:
+                logger.error(
+                    "{} pull error: {}, {}".format(stats.name, e, traceback.format_exc())
+                )
+                self.stop_event.wait(self.pop_timeout)
+                continue
+            if data is None:
+                stats.record_idle()
+                continue
+
+            start = time.time()
+            try:
+                worker.handle(data)
+                stats.record(time.time() - start)
+            except Exception as e:
+                stats.record(time.time() - start, success=False)
+                logger.error(
+                    "{} error: {}, {}".format(stats.name, e, traceback.format_exc())
+                )
+                continue
+            try:
+                worker.ack(data)
+            except Exception as e:
+                logger.error("{} ack error: {}".format(stats.name, e))
+        logger.info(f"{stats.name} stopped: {stats.snapshot()}")
+
+    def report_stats(self):
+        logged_at = time.time()
+        while not self.stop_event.wait(REPORT_INTERVAL):
+            log = time.time() - logged_at >= self.stats_interval
+            if log:
+                logged_at = time.time()
+            for stats in self.stats:
+                if log:
+                    logger.info(f"{stats.name} stats: {stats.snapshot()}")
+                try:
+                    RedisClientProxy.set_worker_statistic(
+                        stats.name, json.dumps(stats.window()), timeout=REPORT_INTERVAL * 3
+                    )
+                except Exception as e:
+                    logger.warning(f"report stats for {stats.name} failed: {e}")
+
+    def stop(self, *args):
+        if not self.stop_event.is_set():
+            logger.info(f"{self.name} stopping")
+        self.stop_event.set()
+
+    def join(self, timeout: Optional[float] = None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+
+def serve_forever(worker_factory, name, num_threads=1, pop_timeout=POP_TIMEOUT):
+    runtime = WorkerRuntime(
+        worker_factory, name=name, num_threads=num_threads, pop_timeout=pop_timeout
+    )
+    runtime.install_signal_handlers()
+    runtime.start()
+    # wake up periodically so that signals are delivered to the main thread
+    while any(thread.is_alive() for thread in runtime.threads):
+        runtime.join(timeout=1)
+
+
+def run_workers(
+    worker_factory: Callable[[], QueueWorker],
+    name: Optional[str] = None,
+    num_processes: int = 1,
+    num_threads: int = 1,
+    pop_timeout: int = POP_TIMEOUT,
+):
+    """Spawn `num_processes` processes with `num_threads` workers each and
+    forward SIGTERM / SIGINT to them for a graceful shutdown."""
+    name = name or getattr(worker_factory, "__name__", "worker")
+    process_list = []
+    for _ in range(num_processes):
+        process = Process(
+            target=serve_forever,
+            args=(worker_factory, name, num_threads, pop_timeout),
+        )
+        process.start()
+        process_list.append(process)
+
+    def shutdown(*args):
+        logger.info(f"{name} shutting down {len(process_list)} process(es)")
+        for process in process_list:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    [process.join() for process in process_list]